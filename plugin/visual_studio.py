@@ -22,15 +22,91 @@ Original Copyright: Copyright (c) 2003-2007 Michael Graz
 
 ############################################################ {{{1
 # Imports
+import array
+import hashlib
+import json
+import math
 import os
 import re
 import sys
+import threading
 import time
+
+############################################################ {{{1
+# Lazy imports
+# PyWin32 is only imported when it is first used, i.e. when the first command
+# talks to Visual Studio.
+class LazyModule:
+    '''Module placeholder that imports the module on first attribute
+    access. For a dotted name, the top level package is returned, as with
+    'import package.module'.'''
+
+    def __init__(self, name):
+        self.__name = name
+        self.__module = None
+
+    def __getattr__(self, attr):
+        if self.__module is None:
+            self.__module = __import__(self.__name)
+        return getattr(self.__module, attr)
+
 # NOTE: 'python import pywintypes' fails with PyWin32 builds > 214.
-import pywintypes
-import pythoncom
-import win32com.client
+pywintypes = LazyModule("pywintypes")
+pythoncom = LazyModule("pythoncom")
+win32com = LazyModule("win32com.client")
 
+############################################################ {{{1
+# Visual Studio constants
+# Build state flags (vsBuildState)
+vsBuildStateNotStarted = 1
+vsBuildStateInProgress = 2
+vsBuildStateDone = 3
+
+# Defines implied by the character set of a configuration (charSet)
+charset_defines = {
+    1: ["UNICODE", "_UNICODE"],
+    2: ["_MBCS"],
+    }
+
+# Code model element kinds (vsCMElement) to index, and the kinds whose
+# children are indexed as well
+code_element_kinds = {
+    1: "class",
+    2: "function",
+    3: "variable",
+    4: "property",
+    5: "namespace",
+    8: "interface",
+    9: "delegate",
+    10: "enum",
+    11: "struct",
+    12: "union",
+    26: "typedef",
+    29: "macro",
+    38: "event",
+    }
+code_element_containers = ("class", "namespace", "interface", "enum",
+        "struct", "union")
+
+# IDispatch constants
+DISPATCH_METHOD = 1
+DISPATCH_PROPERTYGET = 2
+DISPID_NEWENUM = -4
+LOCALE_USER_DEFAULT = 0x400
+DISP_E_MEMBERNOTFOUND = -2147352573
+
+# Type libraries to get DISPIDs from if makepy has been run for them (see
+# doc/vs80-makepy-list.txt)
+makepy_type_libraries = [
+    "Microsoft Development Environment 8.0",
+    "Microsoft Development Environment VC++ Code Model 8.0 Type Library",
+    "Microsoft Development Environment VC++ Project System Engine 8.0 Type Library",
+    "Microsoft Development Environment VC++ Project System Shell 8.0 Type Library",
+    "Microsoft Development Environment 7.1",
+    "Microsoft Development Environment VC++ Code Model 7.1 Type library",
+    "Microsoft Development Environment VC++ Project System Engine 7.0 Type Library",
+    "Microsoft Development Environment VC++ Project System Shell 7.1 Type Library",
+    ]
 
 ############################################################ {{{1
 # Vim module
@@ -51,6 +127,9 @@ logger = logging.getLogger('VS')
 logger.addHandler(logging.NullHandler())
 logger.setLevel(logging.DEBUG)
 
+# Set from g:visual_studio_log_level in the logging setup below
+log_level = 0
+
 ############################################################ {{{1
 class DTEWrapper:
     '''The DTE class encapsulates DTE objects and functionality.'''
@@ -64,6 +143,23 @@ class DTEWrapper:
         # The pid of the current DTE object
         self.current_dte = 0
 
+        # Dict containing {name: metrics} pairs for DTE operations
+        self.metrics = {}
+
+        # Durations and outcomes of builds
+        self.history = BuildHistory(os.path.join(
+            tempfile.gettempdir(), "visual_studio_history.sqlite"))
+
+        # Dict containing {solution name: SymbolIndex} pairs
+        self.symbol_indexes = {}
+
+        # Dict containing {unique name: (stamp, ProjectTree)} pairs
+        self.project_trees = {}
+
+        # Dict containing {key: value} pairs of COM lookups shared between
+        # the operations in a batch; None outside of a batch
+        self.cache = None
+
         # State variable for the UseFullPaths property
         #self.use_full_paths = None
 
@@ -109,39 +205,102 @@ class DTEWrapper:
     active_configuration = property(__get_active_configuration)
 
 
+    ############################################################ {{{2
+    # Batch lookup cache
+    def begin_batch(self):
+        '''Start sharing COM lookups between operations.'''
+        self.cache = {}
+
+    def end_batch(self):
+        '''Stop sharing COM lookups between operations.'''
+        self.cache = None
+
+    def clear_cache(self):
+        '''Forget shared COM lookups, e.g. when the current DTE changes.'''
+        if self.cache is not None:
+            self.cache = {}
+
+    # Return the value of func(*args). Within a batch, the value is computed
+    # once per key.
+    def cached(self, key, func, *args):
+        if self.cache is None:
+            return func(*args)
+        if key not in self.cache:
+            self.cache[key] = func(*args)
+        return self.cache[key]
+
     ############################################################ {{{2
     # Generic helper functions
-    def get_project(self, name = None):
-        def compare_name(project):
-            return project.Name == name
+    def get_projects(self):
+        '''Returns a list of (name, project) pairs sorted by name. Projects
+        without a Properties object are special projects (e.g. solution
+        folders) and are not included.'''
+        def get_projects():
+            projects = [(str(p.Name), p) for p in self.projects
+                    if p.Properties is not None]
+            projects.sort(key = lambda p: p[0])
+            return projects
+        return self.cached("projects", get_projects)
+
+    def get_startup_project_name(self):
+        return self.cached("startup_project",
+                self.get_property, self.solution, "StartupProject")
 
+    def get_project(self, name = None):
         if name is None:
-            name = self.properties.Item("StartupProject").Value
+            name = self.get_startup_project_name()
 
+        projects = self.get_projects()
         logger.debug("%s: project name is %s" %
                 (func_name(), name))
         logger.debug("%s: available project names %s" %
-                (func_name(), [p.Name for p in self.projects]))
+                (func_name(), [p[0] for p in projects]))
         try:
             project = next(
-                    p for p in self.projects if compare_name(p))
+                    p[1] for p in projects if p[0] == name)
             return project
         except StopIteration:
             raise
 
-    def get_tools(self, project):
+    def get_configuration(self, project):
         log_func()
 
         if self.dte is None:
             return None
         else:
             try:
-                return project.Object.Configurations.Item(
-                        self.dte.Solution.SolutionBuild.ActiveConfiguration.Name
-                        ).Tools
-            except AttributeError:
+                names = self.cached("project_configurations",
+                        self.get_project_configuration_names)
+                name = names.get(str(project.UniqueName))
+                if name is None:
+                    name = self.cached("active_configuration",
+                            lambda: get_configuration_name(
+                                self.active_configuration))
+                return project.Object.Configurations.Item(name)
+            except (AttributeError, pywintypes.com_error), e:
                 return None
 
+    # Get a dict containing {project unique name: "Configuration|Platform"}
+    # pairs for the projects built in the active solution configuration
+    def get_project_configuration_names(self):
+        names = {}
+        try:
+            for context in self.active_configuration.SolutionContexts:
+                names[str(context.ProjectName)] = "%s|%s" % (
+                        context.ConfigurationName, context.PlatformName)
+        except (AttributeError, pywintypes.com_error), e:
+            logger.exception(e)
+        return names
+
+    def get_tools(self, project):
+        log_func()
+
+        configuration = self.get_configuration(project)
+        if configuration is None:
+            return None
+        else:
+            return configuration.Tools
+
     def get_compiler_tool(self, project):
         log_func()
 
@@ -172,6 +331,36 @@ class DTEWrapper:
         except Exception, e:
             return False
 
+    # Get the modification time of a project file, or None if the project has
+    # unsaved changes in Visual Studio
+    def get_project_stamp(self, project):
+        try:
+            if not project.Saved:
+                return None
+            return os.path.getmtime(str(project.FullName))
+        except (AttributeError, pywintypes.com_error, OSError), e:
+            return None
+
+    # Get [path, modification time] pairs for the property sheets inherited
+    # by a project in the active configuration, or None if they can't be read
+    def get_property_sheet_stamps(self, project):
+        def add_sheets(stamps, sheets):
+            for sheet in sheets:
+                path = str(sheet.PropertySheetFile)
+                if path not in [p for p, mtime in stamps]:
+                    stamps.append([path, os.path.getmtime(path)])
+                    add_sheets(stamps, sheet.PropertySheets)
+
+        try:
+            configuration = self.get_configuration(project)
+            if configuration is None:
+                return None
+            stamps = []
+            add_sheets(stamps, configuration.PropertySheets)
+            return stamps
+        except (AttributeError, pywintypes.com_error, OSError), e:
+            return None
+
     # Check if a project item is a file
     def is_file(self, item):
         return item.Kind == u'{6BB5F8EE-4483-11D3-8BCF-00C04F8EC28C}'
@@ -184,6 +373,7 @@ class DTEWrapper:
 
         log_func()
 
+        self.clear_cache()
         pid = int(pid)
         if pid == 0 or pid == self.current_dte:
             if (self.current_dte != 0 and
@@ -214,6 +404,7 @@ class DTEWrapper:
 
         log_func()
 
+        self.clear_cache()
         self.dtes = {}
         rot = pythoncom.GetRunningObjectTable()
         rot_enum = rot.EnumRunning()
@@ -240,22 +431,148 @@ class DTEWrapper:
                 self.dtes[pid] = dte
 
     ############################################################ {{{2
-    def wait_for_build(self):
-        '''Wait for Visual Studio to complete the build.'''
+    def execute(self, name, func, *args):
+        '''Run func(operation, dte, *args) as a DTEOperation in a worker
+        thread and wait for it to complete within the deadline configured
+        for name in g:visual_studio_timeout. Returns the result of func.
+        Raises DTETimeout if the deadline expires, and DTEInterrupted if the
+        user interrupts the wait with Ctrl-C or <Esc>.'''
+
+        logger.debug("%s: %s" % (func_name(), name))
+
+        operation = DTEOperation(name, func, *args)
+        operation.start(self.dte)
+        try:
+            return operation.wait(self.get_timeout(name), VimExt.interrupted)
+        finally:
+            self.record_operation(operation)
+
+    def get_timeout(self, name):
+        '''Get the deadline in seconds for the named operation; fall back on
+        the deadline for generic calls. 0 means no deadline.'''
+        timeouts = VimExt.get_var("g:visual_studio_timeout")
+        if not isinstance(timeouts, dict):
+            return 0
+        try:
+            return float(timeouts.get(name, timeouts.get("call", 0)))
+        except ValueError, e:
+            logger.exception(e)
+            return 0
+
+    def record_operation(self, operation):
+        '''Update the timing metrics for an operation.'''
+        metrics = self.metrics.setdefault(operation.name,
+                {"calls": 0, "timeouts": 0, "total": 0.0, "max": 0.0})
+        metrics["calls"] += 1
+        metrics["total"] += operation.duration
+        metrics["max"] = max(metrics["max"], operation.duration)
+        if operation.timed_out:
+            metrics["timeouts"] += 1
+            logger.warning("Operation %s timed out after %.1f seconds." %
+                    (operation.name, operation.duration))
+
+    ############################################################ {{{2
+    def cancel_build(self):
+        '''Cancel the build in progress in Visual Studio.'''
+
+        log_func()
+
+        if self.dte is None:
+            return False
+
+        try:
+            if self.execute("cancel", cancel_build):
+                VimExt.echo("Build cancelled.")
+                return True
+            else:
+                VimExt.echo("No build in progress.")
+        except DTETimeout, e:
+            VimExt.echowarn(e)
+        except pywintypes.com_error, e:
+            logger.exception(e)
+            VimExt.echowarn("Failed to cancel build.")
+        return False
+
+    ############################################################ {{{2
+    def run_build(self, name, func, *args):
+        '''Run a build operation and wait for the build to complete. Returns
+        the BuildMonitor of the build. If the deadline expires, the build is
+        cancelled. func must start the build without waiting for it.'''
 
         log_func()
 
-        # Visual Studio build state flags
-        vsBuildStateNotStarted = 1
-        vsBuildStateInProgress = 2
-        vsBuildStateDone = 3
+        def build(operation, dte, *args):
+            monitor = BuildMonitor()
+            func(dte, *args)
+            wait_for_build(operation, dte, monitor)
+            monitor.finish(dte.Solution.SolutionBuild.LastBuildInfo)
+            return monitor
 
-        build = self.solution_build
         try:
-            while build.BuildState == vsBuildStateInProgress:
-                time.sleep(0.1)
+            return self.execute(name, build, *args)
+        except DTETimeout:
+            self.cancel_build()
+            raise
+
+    ############################################################ {{{2
+    def record_build(self, kind, monitor, configuration = None):
+        '''Add a build to the build history.'''
+
+        log_func()
+
+        try:
+            if configuration is None:
+                configuration = get_configuration_name(
+                        self.active_configuration)
+            self.history.record(str(self.solution.FullName).lower(), kind,
+                    configuration, monitor)
+        except Exception, e:
+            logger.exception(e)
+
+    ############################################################ {{{2
+    def show_build_history(self, report = "slowest"):
+        '''Echo a report on the build history of the current solution:
+        the slowest projects, regressions, or duration percentiles.'''
+
+        log_func()
+
+        if self.dte is None:
+            return
+
+        if report not in ("slowest", "regressions", "percentiles"):
+            VimExt.echowarn("No such report %s." % report)
+            return
+
+        try:
+            lines = getattr(self.history, report)(
+                    str(self.solution.FullName).lower())
         except Exception, e:
             logger.exception(e)
+            VimExt.echowarn("Failed to read build history.")
+            return
+
+        if not lines:
+            VimExt.echo("No builds recorded.")
+        for line in lines:
+            VimExt.echo(line)
+
+    ############################################################ {{{2
+    def show_operation_metrics(self):
+        '''Echo call counts, durations and timeouts of DTE operations.'''
+
+        log_func()
+
+        if not self.metrics:
+            VimExt.echo("No operations recorded.")
+            return
+
+        VimExt.echo("%-12s %6s %8s %8s %8s" %
+                ("Operation", "Calls", "Timeouts", "Avg (s)", "Max (s)"))
+        for name in sorted(self.metrics.keys()):
+            metrics = self.metrics[name]
+            VimExt.echo("%-12s %6d %8d %8.2f %8.2f" %
+                    (name, metrics["calls"], metrics["timeouts"],
+                        metrics["total"] / metrics["calls"], metrics["max"]))
 
     ############################################################ {{{2
     def activate(self):
@@ -266,11 +583,15 @@ class DTEWrapper:
         if self.dte is None:
             return
 
+        def activate(operation, dte):
+            dte.MainWindow.Activate()
+            return dte.MainWindow.Caption
+
         try:
-            self.dte.MainWindow.Activate()
+            caption = self.execute("call", activate)
             logger.debug("%s: main window caption is %s" %
-                    (func_name(), self.dte.MainWindow.Caption))
-        except (TypeError, pywintypes.com_error), e:
+                    (func_name(), caption))
+        except (TypeError, pywintypes.com_error, DTETimeout), e:
             logger.error("Failed to activate Visual Studio main window.")
 
     ############################################################ {{{2
@@ -282,11 +603,14 @@ class DTEWrapper:
         if self.dte is None:
             return
 
-        try:
-            properties = self.dte.Properties("Environment", "Documents")
+        def set_autoload(operation, dte):
+            properties = dte.Properties("Environment", "Documents")
             self.set_property(properties, "DetectFileChangesOutsideIDE", 1)
             self.set_property(properties, "AutoloadExternalChanges", 1)
-        except pywintypes.com_error, e:
+
+        try:
+            self.execute("call", set_autoload)
+        except (pywintypes.com_error, DTETimeout), e:
             logger.exception(e)
 
     ############################################################ {{{2
@@ -314,6 +638,33 @@ class DTEWrapper:
                 logger.debug("%s: compiler is None for project %s" %
                         (func_name(), p.Name))
 
+    def set_use_full_paths_in(self, configurations):
+        '''Set the 'Use full Paths' property in the named configurations of
+        all projects, and save the projects that were changed. Returns the
+        number of projects changed.'''
+
+        log_func()
+
+        changed = 0
+        for name, project in self.get_projects():
+            modified = False
+            for configuration in configurations:
+                try:
+                    compiler = project.Object.Configurations.Item(
+                            configuration).Tools.Item("VCCLCompilerTool")
+                    if not compiler.UseFullPaths:
+                        compiler.UseFullPaths = True
+                        modified = True
+                except (AttributeError, pywintypes.com_error), e:
+                    pass
+            if modified:
+                try:
+                    project.Save()
+                    changed += 1
+                except pywintypes.com_error, e:
+                    logger.exception(e)
+        return changed
+
     ############################################################ {{{2
     def get_task_list(self, output_file):
         '''Retrieves the task list from Visual Studio.'''
@@ -325,36 +676,49 @@ class DTEWrapper:
         if self.dte is None:
             return
 
-        self.dte.ExecuteCommand("View.TaskList")
-        task_list_window = None
-        for window in self.dte.Windows:
-            if str(window.Caption).startswith("Task List"):
-                task_list_window = window
-        if task_list_window is None:
-            VimExt.echowarn("Task List window not active.")
-            return
+        def get_task_list(operation, dte):
+            dte.ExecuteCommand("View.TaskList")
+            task_list_window = None
+            for window in dte.Windows:
+                if str(window.Caption).startswith("Task List"):
+                    task_list_window = window
+            if task_list_window is None:
+                return None
 
-        task_list = task_list_window.Object.TaskItems
-        for item in task_list:
-            try:
-                filename = item.FileName
-            except Exception, e:
-                logger.exception(e)
-                filename = "<no-filename>"
+            tasks = []
+            for item in task_list_window.Object.TaskItems:
+                try:
+                    filename = item.FileName
+                except Exception, e:
+                    logger.exception(e)
+                    filename = "<no-filename>"
 
-            try:
-                line = item.Line
-            except Exception, e:
-                logger.exception(e)
-                line = "<no-line>"
+                try:
+                    line = item.Line
+                except Exception, e:
+                    logger.exception(e)
+                    line = "<no-line>"
 
-            try:
-                description = item.Description
-            except Exception, e:
-                logger.exception(e)
-                description = "<no-description>"
+                try:
+                    description = item.Description
+                except Exception, e:
+                    logger.exception(e)
+                    description = "<no-description>"
 
-            f.write("%s(%s) : %s" % (filename, line, description))
+                tasks.append("%s(%s) : %s\n" % (filename, line, description))
+            return tasks
+
+        try:
+            tasks = self.execute("task_list", get_task_list)
+        except DTETimeout, e:
+            VimExt.echowarn(e)
+            return
+        if tasks is None:
+            VimExt.echowarn("Task List window not active.")
+            return
+
+        f = file(output_file, "w")
+        f.writelines(tasks)
         f.close()
         VimExt.set_var("s:command_status", 1)
 
@@ -370,22 +734,18 @@ class DTEWrapper:
             return
 
         try:
-            window = self.dte.Windows.Item(caption)
+            text = self.execute("output", read_window, caption)
+        except DTETimeout, e:
+            VimExt.echowarn(e)
+            return
         except pywintypes.com_error, e:
             logger.exception(e)
             VimExt.echowarn("Window not active (%s)." % caption)
             return
 
-        if caption == "Output":
-            sel = window.Object.OutputWindowPanes.Item("Build").\
-                TextDocument.Selection
-        else:
-            sel = window.Selection
-        sel.SelectAll()
         f = file(output_file, "w")
-        f.write(sel.Text.replace('\r', ''))
+        f.write(text)
         f.close()
-        sel.Collapse()
 
         VimExt.set_var("s:command_status", 1)
 
@@ -401,13 +761,14 @@ class DTEWrapper:
             return
 
         try:
-            self.dte.ExecuteCommand("Build.Compile")
-            # Wait for build to complete
-            self.wait_for_build()
+            monitor = self.run_build("compile",
+                    lambda dte: dte.ExecuteCommand("Build.Compile"))
+            self.record_build("compile", monitor)
             self.get_output(output_file, "Output")
-            VimExt.set_var("s:command_status", 1)
+        except DTETimeout, e:
+            VimExt.echowarn(e)
         except Exception, e:
-            logger.error("Failed to compile file: %s" % e[2][2])
+            logger.exception(e)
             VimExt.echowarn("Failed to compile file.")
         VimExt.activate()
 
@@ -432,12 +793,15 @@ class DTEWrapper:
 
             logger.info("%s: config = %s, unique name = %s" %
                     (func_name(), config, project.UniqueName))
-            self.solution_build.BuildProject(config, project.UniqueName, 1)
-
-            # Wait for build to complete
-            self.wait_for_build()
+            monitor = self.run_build("build",
+                    lambda dte, config, name:
+                        dte.Solution.SolutionBuild.BuildProject(
+                            config, name, 0),
+                    config, project.UniqueName)
+            self.record_build("project", monitor)
             self.get_output(output_file, "Output")
-            VimExt.set_var("s:command_status", 1)
+        except DTETimeout, e:
+            VimExt.echowarn(e)
         except Exception, e:
             logger.exception(e)
             VimExt.echowarn("Failed to build project.")
@@ -459,16 +823,176 @@ class DTEWrapper:
 
         try:
             self.set_use_full_paths()
-            self.solution_build.Build(1)
-            # Wait for build to complete
-            self.wait_for_build()
+            monitor = self.run_build("build",
+                    lambda dte: dte.Solution.SolutionBuild.Build(0))
+            self.record_build("solution", monitor)
             self.get_output(output_file, "Output")
-            VimExt.set_var("s:command_status", 1)
+        except DTETimeout, e:
+            VimExt.echowarn(e)
         except Exception, e:
             logger.exception(e)
             VimExt.echowarn("Failed to build solution.")
         VimExt.activate()
 
+    ############################################################ {{{2
+    def build_matrix(self, output_file, configurations = ""):
+        '''Build a comma separated list of configuration/platform pairs,
+        e.g. "Debug|Win32,Release|x64", or all solution configurations. The
+        builds are distributed over the Visual Studio instances that have the
+        current solution open, and run concurrently. The output of each build
+        is written to a separate file, and s:matrix_results is set to a list
+        of [configuration, file] pairs.'''
+
+        log_func()
+
+        VimExt.set_var("s:command_status", 0)
+        VimExt.set_var("s:matrix_results", [])
+
+        if self.dte is None:
+            return
+
+        configurations = [c.strip() for c in configurations.split(",")
+                if c.strip()]
+        if not configurations:
+            configurations = [get_configuration_name(c) for c in
+                    self.solution_build.SolutionConfigurations]
+
+        # Find the instances with the current solution open; the current
+        # instance first
+        solution_name = str(self.solution.FullName).lower()
+        current = self.current_dte
+        self.update_dtes()
+        pids = sorted(self.dtes.keys(), key = lambda pid: pid != current)
+        instances = []
+        for pid in pids:
+            try:
+                if str(self.dtes[pid].Solution.FullName).lower() == \
+                        solution_name:
+                    instances.append(self.dtes[pid])
+            except pywintypes.com_error, e:
+                logger.exception(e)
+        logger.info("%s: %d configurations, %d instances" %
+                (func_name(), len(configurations), len(instances)))
+        if not instances:
+            VimExt.echowarn("No Visual Studio instances found.")
+            return
+
+        self.set_autoload()
+
+        # Set 'Use full Paths' once, from this instance, before the builds
+        # start. Builds in the other instances must not change the shared
+        # project files. If this changes them, the other instances stop to
+        # ask about reloading the projects, so only this instance builds.
+        if self.set_use_full_paths_in(configurations) and len(instances) > 1:
+            VimExt.echowarn("Project files changed to use full paths; "
+                    "building in this instance only. Reload the projects in "
+                    "the other instances to build in parallel.")
+            instances = instances[:1]
+
+        # Distribute the configurations over the instances, longest build
+        # first to the least loaded instance. Configurations without
+        # recorded builds are assumed to take as long as the longest one.
+        try:
+            durations = self.history.mean_durations(solution_name)
+        except Exception, e:
+            logger.exception(e)
+            durations = {}
+        estimates = dict((c, durations.get(("(matrix)", c),
+            durations.get(("(solution)", c)))) for c in configurations)
+        known = [d for d in estimates.values() if d is not None]
+        for c in configurations:
+            if estimates[c] is None:
+                estimates[c] = max(known or [1.0])
+        queues = [[] for instance in instances]
+        loads = [0.0 for instance in instances]
+        for c in sorted(configurations, key = lambda c: -estimates[c]):
+            i = min(range(len(instances)),
+                    key = lambda i: (loads[i], len(queues[i])))
+            queues[i].append(c)
+            loads[i] += estimates[c]
+
+        operations = []
+        for instance, queue in zip(instances, queues):
+            if not queue:
+                continue
+            operation = DTEOperation("build", build_configurations, queue)
+            operation.start(instance)
+            operations.append((instance, operation))
+
+        started = time.time()
+        timeout = self.get_timeout("build")
+        results = {}
+        interrupted = False
+        for instance, operation in operations:
+            try:
+                remaining = 0
+                if timeout:
+                    remaining = max(timeout * len(operation.args[0]) -
+                            (time.time() - started), 0.1)
+                if interrupted:
+                    operation.cancel()
+                    raise DTEInterrupted(operation.name)
+                for result in operation.wait(remaining, VimExt.interrupted):
+                    results[result[0]] = result
+            except DTETimeout, e:
+                # Once the user has interrupted one build, cancel the rest
+                if isinstance(e, DTEInterrupted):
+                    interrupted = True
+                VimExt.echowarn(e)
+                try:
+                    cancel = DTEOperation("cancel", cancel_build)
+                    cancel.start(instance)
+                    cancel.wait(self.get_timeout("cancel"))
+                except (DTETimeout, pywintypes.com_error), e:
+                    logger.exception(e)
+            except Exception, e:
+                logger.exception(e)
+                VimExt.echowarn("Failed to build configurations %s." %
+                        ", ".join(operation.args[0]))
+            finally:
+                self.record_operation(operation)
+        elapsed = time.time() - started
+
+        # The serial time is estimated from the mean time of single solution
+        # builds; builds running concurrently take longer than serial ones,
+        # so where there's no history the estimate is an upper bound
+        matrix_results = []
+        serial = 0.0
+        upper_bound = False
+        for i, name in enumerate(configurations):
+            if name not in results:
+                continue
+            name, text, monitor = results[name]
+            if text is None:
+                VimExt.echowarn("No such configuration %s." % name)
+                continue
+            filename = "%s.%d" % (output_file, i)
+            f = file(filename, "w")
+            f.write(text)
+            f.close()
+            matrix_results.append([name, filename])
+            if ("(solution)", name) in durations:
+                serial += durations[("(solution)", name)]
+            else:
+                serial += monitor.duration
+                upper_bound = True
+            self.record_build("matrix", monitor, name)
+            logger.info("%s: %s built in %.1f seconds, %d failed" %
+                    (func_name(), name, monitor.duration, monitor.failed))
+
+        VimExt.set_var("s:matrix_results", matrix_results)
+        VimExt.set_var("s:command_status", 1)
+        saved = serial - elapsed
+        if upper_bound:
+            estimate = "at most"
+        else:
+            estimate = "about"
+        VimExt.echo("Built %d configurations on %d instances in %.1f s "
+                "(serial %s %.1f s, saved %s %.1f s)" %
+                (len(matrix_results), len(operations), elapsed, estimate,
+                    serial, estimate, saved))
+        VimExt.activate()
+
     ############################################################ {{{2
     def set_startup_project(self, project_name):
         '''Set the startup project in Visual Studio.'''
@@ -493,14 +1017,25 @@ class DTEWrapper:
         if self.dte is None:
             return
 
-        doc = self.dte.ActiveDocument
-        if doc is None:
+        def get_file(operation, dte):
+            doc = dte.ActiveDocument
+            if doc is None:
+                return None
+            point = doc.Selection.ActivePoint
+            return (os.path.join(doc.Path, doc.Name),
+                    point.Line, point.DisplayColumn)
+
+        try:
+            location = self.execute("call", get_file)
+        except DTETimeout, e:
+            VimExt.echowarn(e)
+            return
+        if location is None:
             VimExt.echowarn("No file active in Visual Studio.")
             return
-        point = doc.Selection.ActivePoint
-        path = os.path.join(doc.Path, doc.Name)
-        VimExt.command("%s +%d %s" %(action, point.Line, path))
-        VimExt.command("normal %d|" % point.DisplayColumn)
+        path, line, column = location
+        VimExt.command("%s +%d %s" %(action, line, path))
+        VimExt.command("normal %d|" % column)
 
     ############################################################ {{{2
     def put_file(self, filename, line, col):
@@ -514,11 +1049,16 @@ class DTEWrapper:
         logger.debug("%s: absolute path %s" %
                 (func_name(), os.path.abspath(filename)))
 
+        def put_file(operation, dte):
+            dte.ItemOperations.OpenFile(os.path.abspath(filename))
+            dte.ActiveDocument.Selection.MoveToLineAndOffset(line, col)
+
         self.set_autoload()
-        item_op = self.dte.ItemOperations.OpenFile(
-                os.path.abspath(filename))
-        sel = self.dte.ActiveDocument.Selection
-        sel.MoveToLineAndOffset(line, col)
+        try:
+            self.execute("call", put_file)
+        except DTETimeout, e:
+            VimExt.echowarn(e)
+            return
         self.activate()
 
     ############################################################ {{{2
@@ -541,19 +1081,12 @@ class DTEWrapper:
         if self.dte is None:
             return
 
-        startup_project_name = self.get_property(self.solution, "StartupProject")
-        startup_project_index = -1
-        index = 0
-        projects = []
-        for project in sorted(self.projects, cmp = lambda x,y: cmp(x.Name, y.Name)):
-            # Count projects without a Properties object as special projects
-            # that shouldn't be listed.
-            if project.Properties is None:
-                continue
-            if project.Name == startup_project_name:
-                startup_project_index = index
-            projects.append(str(project.Name))
-            index += 1
+        startup_project_name = self.get_startup_project_name()
+        projects = [p[0] for p in self.get_projects()]
+        if startup_project_name in projects:
+            startup_project_index = projects.index(startup_project_name)
+        else:
+            startup_project_index = -1
         VimExt.command("let s:projects = %s" % projects)
         VimExt.command("let s:project_index = %s" %
                 startup_project_index)
@@ -577,34 +1110,80 @@ class DTEWrapper:
             VimExt.echowarn("Failed to update project tree.")
         VimExt.command("let s:project_tree = %s" % project_tree)
 
+    ############################################################ {{{2
+    def update_project_trees(self):
+        '''Update Vim's dict of project trees with the trees of all
+        projects in the solution.'''
+
+        log_func()
+
+        if self.dte is None:
+            return
+
+        project_trees = {}
+        for name, project in self.get_projects():
+            try:
+                project_trees[name] = self.get_project_tree(project)
+            except Exception, e:
+                logger.exception(e)
+                VimExt.echowarn("Failed to update project tree for %s." %
+                        name)
+        VimExt.command("let s:project_trees = %s" % project_trees)
+
     ############################################################ {{{3
-    def get_project_tree(self, item):
+    def get_project_tree(self, project):
         '''Returns a tree (nested lists) of projects and files in projects.
         The first item is the item or item item name. The second item
         contains a list of children or a filename.'''
 
         log_func()
 
-        if self.is_file(item):
-            path = self.get_property(item, "FullPath")
-            if path is not None:
-                return [str(item.Name), str(path)]
+        return self.get_compact_project_tree(project).to_list()
 
-        # Find children to the item
-        children = []
+    ############################################################ {{{3
+    def get_compact_project_tree(self, project):
+        '''Returns the ProjectTree of a project. Trees are cached, and only
+        rebuilt if the project has changed.'''
+
+        log_func()
 
-        # Item has a sub project
-        #if item.SubProject is not None:
-        #    children += self.get_project_tree(item.SubProject)
+        key = str(project.UniqueName)
+        stamp = self.get_project_stamp(project)
+        if key in self.project_trees:
+            cached_stamp, tree = self.project_trees[key]
+            if stamp is not None and cached_stamp == stamp:
+                return tree
+
+        tree = ProjectTree()
+        project = dispatch(project)
+        root = tree.add(-1, str(project.Name))
+        self.add_project_items(tree, root, project.ProjectItems)
+        tree.freeze()
+        self.project_trees[key] = (stamp, tree)
+        logger.debug("%s: %d nodes, %d strings in project %s" %
+                (func_name(), len(tree), len(tree.strings), key))
+        return tree
 
-        # Item has project items
-        if item.ProjectItems is not None:
-            temp = [self.get_project_tree(x) for x in item.ProjectItems]
-            logger.debug("%s: found project item name %s" %
-                    (func_name(), temp))
-            children += temp
+    ############################################################ {{{3
+    def add_project_items(self, tree, parent, items):
+        '''Recursive function that adds the items in a ProjectItems object
+        to a ProjectTree.'''
+
+        if items is None:
+            return
+
+        for item in items:
+            path = None
+            if self.is_file(item):
+                path = self.get_property(item, "FullPath")
+                if path is not None:
+                    path = str(path)
+            node = tree.add(parent, str(item.Name), path)
 
-        return [str(item.Name), children]
+            # Add subitems
+            #if item.SubProject is not None:
+            #    self.add_project_items(tree, node, item.SubProject.ProjectItems)
+            self.add_project_items(tree, node, item.ProjectItems)
 
     ############################################################ {{{2
     def update_project_files_list(self, project_name = None):
@@ -619,43 +1198,993 @@ class DTEWrapper:
         files = []
         try:
             project = self.get_project(project_name)
-            files = self.get_project_items_files(project.ProjectItems)
+            files = self.get_compact_project_tree(project).files()
         except Exception, e:
             logger.exception(e)
             VimExt.echowarn("Failed to update project files.")
         VimExt.command("let s:project_files = %s" % files)
 
+    ############################################################ {{{2
+    def export_compile_commands(self, force = "0", output_file = None):
+        '''Write a compile_commands.json for the active configuration. Only
+        projects whose project file or property sheets have changed since the
+        previous export are queried for compiler settings and files; the rest
+        are taken from the cache. If force is non-zero, all projects are
+        queried, e.g. after changing environment variables used in build
+        macros.'''
+
+        log_func()
+
+        if self.dte is None:
+            return
+
+        solution_name = str(self.solution.FullName)
+        if output_file is None:
+            output_file = os.path.join(
+                    os.path.dirname(solution_name), "compile_commands.json")
+
+        config_name = get_configuration_name(self.active_configuration)
+
+        # Share the project configuration lookups between the projects
+        batch = self.cache is None
+        if batch:
+            self.begin_batch()
+        try:
+            self.update_compile_commands(output_file, config_name, force)
+        finally:
+            if batch:
+                self.end_batch()
+
+    def update_compile_commands(self, output_file, config_name, force):
+        '''Update the cache of compiler settings and write output_file; see
+        export_compile_commands.'''
+        solution_name = str(self.solution.FullName)
+
+        # Version 2 caches hold the settings of the project configuration
+        # built in the solution configuration, including its platform
+        cache_file = get_cache_file(solution_name, "compile_commands")
+        cache = load_json(cache_file, {})
+        if (cache.get("config") != config_name or
+                cache.get("version") != 2 or int(force)):
+            cache = {"config": config_name, "version": 2, "projects": {}}
+
+        projects = {}
+        updated = 0
+        for project in self.projects:
+            # Special projects (e.g. solution folders) have no settings
+            if project.Properties is None:
+                continue
+
+            name = str(project.UniqueName)
+            cached = cache["projects"].get(name)
+            stamp = self.get_project_stamp(project)
+            sheets = self.get_property_sheet_stamps(project)
+            if stamp is not None and sheets is not None:
+                stamp = [stamp, sheets]
+            else:
+                stamp = None
+            if (cached is not None and stamp is not None and
+                    cached["stamp"] == stamp):
+                projects[name] = cached
+                continue
+
+            settings = self.get_compile_settings(project)
+            if settings is None:
+                logger.debug("%s: no compiler settings for project %s" %
+                        (func_name(), name))
+                continue
+            files = [f for f in
+                    self.get_compact_project_tree(project).files()
+                    if is_source_file(f)]
+
+            if (cached is None or cached["settings"] != settings or
+                    cached["files"] != files):
+                updated += 1
+            projects[name] = {
+                    "stamp": stamp,
+                    "settings": settings,
+                    "files": files}
+
+        changed = (updated > 0 or
+                set(projects.keys()) != set(cache["projects"].keys()) or
+                not os.path.exists(output_file))
+        cache["projects"] = projects
+        save_json(cache_file, cache)
+
+        if changed:
+            commands = []
+            for name in sorted(projects.keys()):
+                commands += get_compile_commands(projects[name])
+            save_json(output_file, commands)
+            VimExt.echo("Wrote %d entries to %s (%d of %d projects updated)" %
+                    (len(commands), output_file, updated, len(projects)))
+        else:
+            VimExt.echo("%s is up to date." % output_file)
+
     ############################################################ {{{3
-    def get_project_items_files(self, items):
-        '''Recursive function that returns a list of files in a ProjectItems
-        object.'''
+    def get_compile_settings(self, project):
+        '''Returns the compiler settings of a project in the active
+        configuration as a dict, with build macros expanded.'''
 
         log_func()
 
-        files = []
-        for item in items:
-            # Add the item itself
-            if self.is_file(item):
-                path = self.get_property(item, "FullPath")
-                if path is not None:
-                    files.append(str(path))
+        configuration = self.get_configuration(project)
+        compiler = self.get_compiler_tool(project)
+        if configuration is None or compiler is None:
+            return None
 
-            # Add files from subprojects
-            #if item.SubProject is not None:
-                #sub_project_items = item.SubProject.ProjectItems
-                #files += self.get_project_items_files(sub_project_items)
+        def evaluate(name):
+            try:
+                value = getattr(compiler, name)
+                if not value:
+                    return ""
+                return str(configuration.Evaluate(value))
+            except (AttributeError, pywintypes.com_error), e:
+                logger.exception(e)
+                return ""
+
+        def split(value):
+            return [v.strip() for v in re.split(r"[;,]", value) if v.strip()]
+
+        # The character set adds defines of its own
+        defines = split(evaluate("PreprocessorDefinitions"))
+        try:
+            defines += [d for d in
+                    charset_defines.get(configuration.CharacterSet, [])
+                    if d not in defines]
+        except (AttributeError, pywintypes.com_error), e:
+            logger.exception(e)
+
+        return {
+                "directory": os.path.dirname(str(project.FullName)),
+                "includes": split(evaluate("AdditionalIncludeDirectories")),
+                "defines": defines,
+                "forced_includes": split(evaluate("ForcedIncludeFiles")),
+                "options": [o.replace('"', '') for o in
+                    re.findall(r'(?:[^\s"]|"[^"]*")+',
+                        evaluate("AdditionalOptions"))]}
+
+    ############################################################ {{{2
+    def get_symbol_index(self):
+        '''Returns the SymbolIndex of the current solution.'''
+
+        log_func()
+
+        solution_name = str(self.solution.FullName).lower()
+        if solution_name not in self.symbol_indexes:
+            self.symbol_indexes[solution_name] = SymbolIndex(
+                    get_cache_file(solution_name, "symbols", "sqlite"))
+        return self.symbol_indexes[solution_name]
+
+    ############################################################ {{{2
+    def update_symbol_index(self):
+        '''Update the symbol index of the current solution from the code
+        model. Only files that have been modified since they were last
+        indexed are read.'''
+
+        log_func()
+
+        if self.dte is None:
+            return
+
+        index = self.get_symbol_index()
+        files = set()
+        for name, project in self.get_projects():
+            try:
+                files.update([f for f in
+                    self.get_compact_project_tree(project).files()
+                    if is_code_file(f)])
+            except Exception, e:
+                logger.exception(e)
+
+        stamps = index.stamps()
+        index.remove([path for path in stamps if path not in files])
+        changed = []
+        for path in sorted(files):
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError, e:
+                continue
+            if stamps.get(path) != mtime:
+                changed.append((path, mtime))
+
+        # Index the files in chunks, so that a deadline applies to each
+        # chunk, and indexed chunks are kept if a later chunk fails
+        indexed = 0
+        chunk_size = 50
+        for i in range(0, len(changed), chunk_size):
+            chunk = dict(changed[i:i + chunk_size])
+            VimExt.command("redraw | echo 'Indexing symbols (%d of %d)'" %
+                    (i, len(changed)))
+            try:
+                results = self.execute("symbols", read_code_models,
+                        sorted(chunk.keys()))
+            except DTETimeout, e:
+                VimExt.echowarn(e)
+                break
+            except Exception, e:
+                logger.exception(e)
+                VimExt.echowarn("Failed to read code model.")
+                break
+            index.update([(path, chunk[path], symbols)
+                for path, symbols in results])
+            indexed += len(results)
+
+        VimExt.echo("Indexed %d of %d changed files; %d symbols in %d files" %
+                (indexed, len(changed), index.count(), len(files)))
+
+    ############################################################ {{{2
+    def update_symbol_file(self, path):
+        '''Update the symbols of one file after it has been written. Only
+        files already in the symbol index are read, so writing a file does
+        nothing until update_symbol_index has been run.'''
+
+        log_func()
+
+        if self.dte is None or not is_code_file(path):
+            return
+
+        index = self.get_symbol_index()
+        if index.connection is None and not os.path.exists(index.filename):
+            return
+
+        # Paths are compared as Visual Studio and Vim may spell them
+        # differently
+        stamps = index.stamps()
+        paths = dict((p.lower().replace("/", "\\"), p) for p in stamps)
+        path = paths.get(path.lower().replace("/", "\\"))
+        if path is None:
+            return
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError, e:
+            return
+        if stamps[path] == mtime:
+            return
+
+        try:
+            results = self.execute("symbols", read_code_models, [path])
+        except DTETimeout, e:
+            VimExt.echowarn(e)
+            return
+        except Exception, e:
+            logger.exception(e)
+            VimExt.echowarn("Failed to read code model.")
+            return
+        index.update([(p, mtime, symbols) for p, symbols in results])
+
+    ############################################################ {{{2
+    def find_symbols(self, query, limit = 50):
+        '''Update Vim's list of symbols matching query with [name, full
+        name, kind, path, line] lists.'''
 
-            # Add files from subitems
-            files += self.get_project_items_files(item.ProjectItems)
+        log_func()
+
+        symbols = []
+        if self.dte is not None:
+            try:
+                symbols = [list(symbol) for symbol in
+                    self.get_symbol_index().lookup(query, int(limit))]
+            except Exception, e:
+                logger.exception(e)
+                VimExt.echowarn("Failed to look up symbols.")
+        # Symbol names may contain any character; to_vim() encodes them
+        VimExt.let("s:symbols", symbols)
+
+############################################################ {{{1
+class SymbolIndex:
+    '''Index of the symbols in the code model of a solution, stored in an
+    SQLite database. Each file is stored with the modification time it had
+    when it was indexed, so that only changed files are indexed again. The
+    database is opened on first use.'''
+
+    ############################################################ {{{2
+    # Initialization
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            import sqlite3
+            self.connection = sqlite3.connect(self.filename)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY, mtime REAL);
+                CREATE TABLE IF NOT EXISTS symbols (
+                    name TEXT, lname TEXT, full_name TEXT, kind TEXT,
+                    path TEXT, line INTEGER);
+                CREATE INDEX IF NOT EXISTS symbols_lname ON symbols (lname);
+                CREATE INDEX IF NOT EXISTS symbols_path ON symbols (path);
+                """)
+        return self.connection
+
+    ############################################################ {{{2
+    def stamps(self):
+        '''Returns a dict containing {path: mtime} pairs for the indexed
+        files.'''
+        return dict(self.connect().execute("SELECT path, mtime FROM files"))
+
+    def count(self):
+        return self.connect().execute(
+                "SELECT COUNT(*) FROM symbols").fetchone()[0]
+
+    def update(self, files):
+        '''Replace the symbols of files, given as (path, mtime, symbols)
+        tuples, where symbols are (name, full name, kind, line) tuples.'''
+        connection = self.connect()
+        for path, mtime, symbols in files:
+            connection.execute("DELETE FROM symbols WHERE path = ?", (path,))
+            connection.executemany(
+                    "INSERT INTO symbols VALUES (?, ?, ?, ?, ?, ?)",
+                    [(name, name.lower(), full_name, kind, path, line)
+                        for name, full_name, kind, line in symbols])
+            connection.execute("INSERT OR REPLACE INTO files VALUES (?, ?)",
+                    (path, mtime))
+        connection.commit()
+
+    def remove(self, paths):
+        '''Remove files and their symbols from the index.'''
+        connection = self.connect()
+        for path in paths:
+            connection.execute("DELETE FROM symbols WHERE path = ?", (path,))
+            connection.execute("DELETE FROM files WHERE path = ?", (path,))
+        connection.commit()
+
+    ############################################################ {{{2
+    def lookup(self, query, limit = 50):
+        '''Returns up to limit (name, full name, kind, path, line) tuples
+        for the symbols whose names start with query, followed by the
+        symbols whose names contain the characters of query in order. Case
+        is ignored, and shorter names come first.'''
+        if isinstance(query, str):
+            query = query.decode("utf-8", "replace")
+        query = query.lower()
+        end = query + u"\uffff"
+
+        connection = self.connect()
+        symbols = connection.execute("""
+                SELECT name, full_name, kind, path, line FROM symbols
+                WHERE lname >= ? AND lname < ?
+                ORDER BY length(name), name LIMIT ?""",
+                (query, end, limit)).fetchall()
+        if len(symbols) < limit and len(query) > 1:
+            pattern = "%" + "%".join([re.sub(r"([%_\\])", r"\\\1", c)
+                for c in query]) + "%"
+            symbols += connection.execute("""
+                    SELECT name, full_name, kind, path, line FROM symbols
+                    WHERE lname LIKE ? ESCAPE '\\'
+                        AND NOT (lname >= ? AND lname < ?)
+                    ORDER BY length(name), name LIMIT ?""",
+                    (pattern, query, end, limit - len(symbols))).fetchall()
+        return symbols
+
+############################################################ {{{1
+class ProjectTree:
+    '''Compact tree of project items. Nodes are stored in arrays indexed by
+    node id, and link to their parent, first child and next sibling. Names
+    and paths are stored as ids in a table of unique strings. A file path is
+    split into a directory and a base name, so directory prefixes shared by
+    many files are only stored once.'''
+
+    ############################################################ {{{2
+    # Initialization
+    def __init__(self):
+        # Unique strings, and {string: id} pairs to look them up
+        self.strings = []
+        self.string_ids = {}
+
+        # String ids of node names, and of file directories and base names
+        # (-1 for nodes that are not files)
+        self.names = array.array('i')
+        self.dirs = array.array('i')
+        self.bases = array.array('i')
+
+        # Node ids of parents, children and siblings (-1 for none)
+        self.parents = array.array('i')
+        self.first_child = array.array('i')
+        self.last_child = array.array('i')
+        self.next_sibling = array.array('i')
+
+    def __len__(self):
+        return len(self.names)
+
+    def intern(self, s):
+        '''Returns the id of a string in the string table.'''
+        try:
+            return self.string_ids[s]
+        except KeyError:
+            self.string_ids[s] = len(self.strings)
+            self.strings.append(intern(s))
+            return self.string_ids[s]
 
+    ############################################################ {{{2
+    def add(self, parent, name, path = None):
+        '''Add a node under parent (-1 for the root node) and return its
+        id. Nodes with a path are files.'''
+        node = len(self.names)
+        self.names.append(self.intern(name))
+        if path is not None:
+            i = max(path.rfind("\\"), path.rfind("/")) + 1
+            self.dirs.append(self.intern(path[:i]))
+            self.bases.append(self.intern(path[i:]))
+        else:
+            self.dirs.append(-1)
+            self.bases.append(-1)
+
+        self.parents.append(parent)
+        self.first_child.append(-1)
+        self.last_child.append(-1)
+        self.next_sibling.append(-1)
+        if parent >= 0:
+            if self.first_child[parent] == -1:
+                self.first_child[parent] = node
+            else:
+                self.next_sibling[self.last_child[parent]] = node
+            self.last_child[parent] = node
+        return node
+
+    def freeze(self):
+        '''Drop the tables that are only needed while adding nodes.'''
+        self.string_ids = None
+        self.last_child = None
+
+    ############################################################ {{{2
+    def name(self, node):
+        return self.strings[self.names[node]]
+
+    def path(self, node):
+        '''Returns the path of a file node, or None.'''
+        if self.dirs[node] == -1:
+            return None
+        return self.strings[self.dirs[node]] + self.strings[self.bases[node]]
+
+    def children(self, node):
+        child = self.first_child[node]
+        while child != -1:
+            yield child
+            child = self.next_sibling[child]
+
+    ############################################################ {{{2
+    def to_list(self, node = 0):
+        '''Expand a node to nested lists: [name, path] for files and
+        [name, [children]] for other nodes.'''
+        if len(self) == 0:
+            return []
+        path = self.path(node)
+        if path is not None:
+            return [self.name(node), path]
+        return [self.name(node),
+                [self.to_list(child) for child in self.children(node)]]
+
+    def files(self):
+        '''Returns the paths of all file nodes in depth first order.'''
+        files = []
+        stack = []
+        if len(self) > 0:
+            stack.append(0)
+        while stack:
+            node = stack.pop()
+            if self.dirs[node] != -1:
+                files.append(self.path(node))
+            stack.extend(reversed(list(self.children(node))))
         return files
 
+############################################################ {{{1
+class DispatchProxy:
+    '''Late-bound wrapper of an IDispatch object that caches DISPIDs per
+    interface, so that GetIDsOfNames is called once per interface and member
+    name rather than on every access. The interface of an object is the IID
+    in its type info, so objects that share a cache really implement the
+    same interface, whatever the path to them. If an object has no type
+    info, DISPIDs are cached per object.
+
+    Properties are read as attributes; collections are iterated and indexed
+    with Item(). The wrapped object only needs GetTypeInfo(),
+    GetIDsOfNames() and Invoke(), so the proxy works with a fake IDispatch
+    object as well.'''
+
+    # Dict containing {IID: {name: dispid}} pairs, shared by all proxies
+    dispids = {}
+
+    # Set when the makepy type libraries have been looked for
+    type_libraries_loaded = False
+
+    ############################################################ {{{2
+    # Initialization
+    def __init__(self, oleobj):
+        self._oleobj_ = oleobj
+        self._type = DispatchProxy.get_type_name(oleobj)
+        if self._type is None:
+            self._dispids = {}
+        else:
+            self._dispids = DispatchProxy.dispids.setdefault(self._type, {})
+
+    @staticmethod
+    def get_type_name(oleobj):
+        '''Returns the IID of the interface described by the type info of
+        an object, or None if it has no type info.'''
+        try:
+            return str(oleobj.GetTypeInfo().GetTypeAttr().iid)
+        except Exception, e:
+            return None
+
+    def __repr__(self):
+        return "<DispatchProxy %s>" % self._type
+
+    ############################################################ {{{2
+    def _get_dispid(self, name, refresh = False):
+        '''Returns the DISPID of a member, calling GetIDsOfNames only if
+        the DISPID isn't cached for the type.'''
+        if refresh or name not in self._dispids:
+            self._dispids[name] = self._oleobj_.GetIDsOfNames(name)
+        return self._dispids[name]
+
+    def _invoke(self, name, *args):
+        flags = DISPATCH_METHOD | DISPATCH_PROPERTYGET
+        try:
+            result = self._oleobj_.Invoke(self._get_dispid(name),
+                    LOCALE_USER_DEFAULT, flags, True, *args)
+        except Exception, e:
+            # Some objects resolve members dynamically; look the member up
+            # again
+            if not e.args or e.args[0] != DISP_E_MEMBERNOTFOUND:
+                raise
+            result = self._oleobj_.Invoke(self._get_dispid(name, True),
+                    LOCALE_USER_DEFAULT, flags, True, *args)
+        return self._wrap(result)
+
+    def _wrap(self, result):
+        '''Wrap IDispatch results in proxies.'''
+        if not (hasattr(result, "Invoke") and
+                hasattr(result, "GetIDsOfNames")):
+            return result
+        return DispatchProxy(result)
+
+    ############################################################ {{{2
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._invoke(name)
+
+    def Item(self, *args):
+        return self._invoke("Item", *args)
+
+    def __iter__(self):
+        enum = self._oleobj_.Invoke(DISPID_NEWENUM, LOCALE_USER_DEFAULT,
+                DISPATCH_METHOD | DISPATCH_PROPERTYGET, True)
+        if not hasattr(enum, "Next"):
+            enum = enum.QueryInterface(pythoncom.IID_IEnumVARIANT)
+        while True:
+            items = enum.Next(64)
+            if not items:
+                break
+            for item in items:
+                yield self._wrap(item)
+
+    ############################################################ {{{2
+    @classmethod
+    def load_type_libraries(cls, descriptions):
+        '''Seed the DISPID cache with the properties of the interfaces in
+        the makepy generated modules for the described type libraries. Type
+        libraries that makepy hasn't been run for are skipped. Returns the
+        number of interfaces found.'''
+        cls.type_libraries_loaded = True
+        try:
+            from win32com.client import gencache, selecttlb
+        except ImportError, e:
+            logger.exception(e)
+            return 0
+
+        def version(v):
+            if isinstance(v, basestring):
+                return int(v, 16)
+            return int(v)
+
+        count = 0
+        for tlb in selecttlb.EnumTlbs():
+            if tlb.desc not in descriptions:
+                continue
+            try:
+                module = gencache.GetModuleForTypelib(tlb.clsid,
+                        version(tlb.lcid), version(tlb.major),
+                        version(tlb.minor))
+            except (ImportError, ValueError), e:
+                logger.debug("No makepy module for %s" % tlb.desc)
+                continue
+            for name, value in vars(module).items():
+                props = getattr(value, "_prop_map_get_", None)
+                if not isinstance(props, dict):
+                    continue
+                # The CLSID of a makepy dispatch class is the IID of its
+                # interface
+                iid = getattr(value, "CLSID", None)
+                if iid is None:
+                    continue
+                dispids = cls.dispids.setdefault(str(iid), {})
+                for prop, spec in props.items():
+                    dispids.setdefault(prop, spec[0])
+                count += 1
+        logger.info("Loaded DISPIDs for %d interfaces from makepy modules" %
+                count)
+        return count
+
+############################################################ {{{1
+class BuildMonitor:
+    '''Follows the output in the Build pane during a build, and times each
+    project from its "Build started" line to its summary line. Error and
+    warning lines are counted per project. Used from worker threads.'''
+
+    # Build output lines; the optional "N>" prefix tells concurrently built
+    # projects apart
+    started_re = re.compile(r"^(?:(\d+)>)?-+ (?:Rebuild All|Build) started: "
+            r"Project: (.+?), Configuration: (.+?) -+\s*$")
+    summary_re = re.compile(r"^(?:(\d+)>)?.* - (\d+) error\(s\), "
+            r"(\d+) warning\(s\)")
+    result_re = re.compile(r"^(?:(\d+)>)?Build (succeeded|FAILED)\.")
+    error_re = re.compile(r"^(?:(\d+)>)?.*: (?:fatal )?error [A-Za-z]*\d+")
+    warning_re = re.compile(r"^(?:(\d+)>)?.*: warning [A-Za-z]*\d+")
+
+    ############################################################ {{{2
+    # Initialization
+    def __init__(self):
+        self.started = time.time()
+        self.finished = None
+        self.failed = 0
+
+        # Next line to read in the Build pane, or None if the pane can't be
+        # read
+        self.line = 1
+
+        # Dict containing {prefix: project} pairs for projects being built,
+        # and the list of built projects. Projects are dicts with the keys
+        # project, configuration, started, finished, errors, warnings and
+        # outcome.
+        self.active = {}
+        self.projects = []
+
+    def __get_duration(self):
+        return (self.finished or time.time()) - self.started
+    duration = property(__get_duration)
+
+    def __get_errors(self):
+        return sum([p["errors"] for p in self.projects])
+    errors = property(__get_errors)
+
+    def __get_warnings(self):
+        return sum([p["warnings"] for p in self.projects])
+    warnings = property(__get_warnings)
+
+    ############################################################ {{{2
+    def poll(self, dte, final = False):
+        '''Read the lines added to the Build pane since the last poll. The
+        last line may be incomplete and is only read if final is set.'''
+        if self.line is None:
+            return
+        try:
+            document = dte.Windows.Item("Output").Object.\
+                OutputWindowPanes.Item("Build").TextDocument
+            end = document.EndPoint.Line
+            if end < self.line:
+                # The pane has been cleared
+                self.line = 1
+            if final:
+                end += 1
+            if end > self.line:
+                text = document.StartPoint.CreateEditPoint().GetLines(
+                        self.line, end)
+                self.line = end
+                self.feed(text.replace("\r", "").split("\n"), time.time())
+        except Exception, e:
+            logger.exception(e)
+            self.line = None
+
+    ############################################################ {{{2
+    def feed(self, lines, now):
+        '''Update the projects from lines of build output read at time
+        now.'''
+        for line in lines:
+            m = self.started_re.match(line)
+            if m:
+                prefix = m.group(1) or ""
+                self.end(prefix, now)
+                configuration = m.group(3).rsplit(" ", 1)
+                self.active[prefix] = {
+                        "project": m.group(2),
+                        "configuration": "|".join(configuration),
+                        "started": now,
+                        "finished": None,
+                        "errors": 0,
+                        "warnings": 0,
+                        "outcome": None}
+                continue
+
+            m = self.summary_re.match(line)
+            if m and (m.group(1) or "") in self.active:
+                project = self.active[m.group(1) or ""]
+                project["errors"] = int(m.group(2))
+                project["warnings"] = int(m.group(3))
+                self.end(m.group(1) or "", now)
+                continue
+
+            m = self.result_re.match(line)
+            if m:
+                if m.group(2) == "FAILED":
+                    self.end(m.group(1) or "", now, "failed")
+                else:
+                    self.end(m.group(1) or "", now)
+                continue
+
+            for regex, key in ((self.error_re, "errors"),
+                    (self.warning_re, "warnings")):
+                m = regex.match(line)
+                if m and (m.group(1) or "") in self.active:
+                    self.active[m.group(1) or ""][key] += 1
+                    break
+
+    def end(self, prefix, now, outcome = None):
+        '''Finish the project being built with the prefix, if any.'''
+        project = self.active.pop(prefix, None)
+        if project is None:
+            return
+        if outcome is None:
+            if project["errors"] > 0:
+                outcome = "failed"
+            else:
+                outcome = "succeeded"
+        project["finished"] = now
+        project["outcome"] = outcome
+        self.projects.append(project)
+
+    def finish(self, failed):
+        '''Finish the build; failed is the number of projects that failed
+        to build.'''
+        self.finished = time.time()
+        self.failed = failed
+        for prefix in self.active.keys():
+            self.end(prefix, self.finished)
+
+############################################################ {{{1
+class BuildHistory:
+    '''Build history in an SQLite database. There is one row per build
+    with an empty project name, and one row per project in the build, with
+    duration, error and warning counts, and outcome. The database is opened
+    on first use.'''
+
+    ############################################################ {{{2
+    # Initialization
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            import sqlite3
+            self.connection = sqlite3.connect(self.filename)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS builds (
+                    time REAL, solution TEXT, kind TEXT, project TEXT,
+                    configuration TEXT, duration REAL, errors INTEGER,
+                    warnings INTEGER, outcome TEXT)""")
+            self.connection.execute("""
+                CREATE INDEX IF NOT EXISTS builds_project ON builds (
+                    solution, project, configuration, time)""")
+        return self.connection
+
+    ############################################################ {{{2
+    def record(self, solution, kind, configuration, monitor):
+        '''Add a build and its projects from a finished BuildMonitor.'''
+        if monitor.failed > 0 or monitor.errors > 0:
+            outcome = "failed"
+        else:
+            outcome = "succeeded"
+        rows = [(monitor.started, solution, kind, "", configuration,
+            monitor.duration, monitor.errors, monitor.warnings, outcome)]
+        for p in monitor.projects:
+            rows.append((p["started"], solution, kind, p["project"],
+                p["configuration"], p["finished"] - p["started"],
+                p["errors"], p["warnings"], p["outcome"]))
+
+        connection = self.connect()
+        connection.executemany(
+                "INSERT INTO builds VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        connection.commit()
+
+    ############################################################ {{{2
+    def durations(self, solution):
+        '''Returns a dict containing {(name, configuration): durations}
+        pairs for the successful builds of a solution, oldest first. The name
+        is the project name, or the kind in parentheses for whole builds,
+        e.g. "(solution)". Projects in single file compiles and in matrix
+        builds are left out; the first aren't whole project builds, and the
+        second share the machine with builds in other instances.'''
+        durations = {}
+        for project, configuration, duration in self.connect().execute("""
+                SELECT CASE WHEN project = '' THEN '(' || kind || ')'
+                    ELSE project END,
+                    configuration, duration FROM builds
+                WHERE solution = ? AND outcome = 'succeeded'
+                    AND NOT (kind IN ('compile', 'matrix') AND project <> '')
+                ORDER BY time""", (solution,)):
+            durations.setdefault((project, configuration), []).append(
+                    duration)
+        return durations
+
+    def mean_durations(self, solution):
+        '''Returns a dict containing {(project, configuration): mean
+        duration} pairs; use it to order builds longest first.'''
+        return dict((key, sum(d) / len(d))
+                for key, d in self.durations(solution).items())
+
+    ############################################################ {{{2
+    # Reports; each returns a list of lines
+    def slowest(self, solution, count = 10):
+        '''The projects with the longest mean build times.'''
+        durations = [(sum(d) / len(d), max(d), len(d), key)
+                for key, d in self.durations(solution).items()
+                if not key[0].startswith("(")]
+        durations.sort(reverse = True)
+        lines = []
+        for mean, longest, builds, key in durations[:count]:
+            lines.append("%-30s %-20s %8.1f s %8.1f s %4d builds" %
+                    (key + (mean, longest, builds)))
+        if lines:
+            lines.insert(0, "%-30s %-20s %10s %10s" %
+                    ("Project", "Configuration", "Mean", "Max"))
+        return lines
+
+    def percentiles(self, solution):
+        '''The 50th, 90th and 99th percentile build times of the
+        projects.'''
+        lines = []
+        for key, d in sorted(self.durations(solution).items()):
+            if not key[0].startswith("("):
+                lines.append("%-30s %-20s %8.1f s %8.1f s %8.1f s" %
+                        (key + tuple([percentile(d, p)
+                            for p in (50, 90, 99)])))
+        if lines:
+            lines.insert(0, "%-30s %-20s %10s %10s %10s" %
+                    ("Project", "Configuration", "p50", "p90", "p99"))
+        return lines
+
+    def regressions(self, solution, factor = 1.25, window = 10):
+        '''Builds whose latest build time exceeds the median of up to
+        window builds before it by factor, and by at least a second.'''
+        lines = []
+        for key, d in sorted(self.durations(solution).items()):
+            if len(d) < 4:
+                continue
+            latest = d[-1]
+            median = percentile(d[-window - 1:-1], 50)
+            if (median > 0 and latest > median * factor and
+                    latest - median >= 1.0):
+                lines.append("%-30s %-20s %8.1f s %8.1f s %+6.0f%%" %
+                        (key[0], key[1], latest, median,
+                            100.0 * (latest - median) / median))
+        if lines:
+            lines.insert(0, "%-30s %-20s %10s %10s %7s" %
+                    ("Project", "Configuration", "Latest", "Median",
+                        "Change"))
+        return lines
+
+############################################################ {{{1
+class DTETimeout(Exception):
+    '''Raised when a DTE operation doesn't complete before its deadline.'''
+
+    def __init__(self, name, timeout):
+        Exception.__init__(self,
+                "Visual Studio did not respond within %d seconds (%s)." %
+                (timeout, name))
+        self.name = name
+        self.timeout = timeout
+
+class DTEInterrupted(DTETimeout):
+    '''Raised when the user interrupts the wait for a DTE operation. It is
+    handled like a timeout.'''
+
+    def __init__(self, name):
+        Exception.__init__(self,
+                "Interrupted while waiting for Visual Studio (%s)." % name)
+        self.name = name
+        self.timeout = None
+
+############################################################ {{{1
+class DTEOperation:
+    '''A DTE operation running in a worker thread. The worker uses its own
+    marshalled reference to the DTE object, so the calling thread can give up
+    on the operation when the deadline expires, e.g. when Visual Studio is
+    blocked by a modal dialog.'''
+
+    ############################################################ {{{2
+    # Initialization
+    def __init__(self, name, func, *args):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.cancelled = threading.Event()
+        self.thread = None
+        self.result = None
+        self.error = None
+        self.started = 0.0
+        self.finished = None
+        self.timed_out = False
+
+    def __get_duration(self):
+        if self.finished is None:
+            return time.time() - self.started
+        return self.finished - self.started
+    duration = property(__get_duration)
+
+    ############################################################ {{{2
+    def start(self, dte):
+        '''Start the operation on dte in a worker thread.'''
+        stream = pythoncom.CoMarshalInterThreadInterfaceInStream(
+                pythoncom.IID_IDispatch, dte._oleobj_)
+        self.started = time.time()
+        self.thread = threading.Thread(target = self.run, args = (stream,))
+        self.thread.setDaemon(True)
+        self.thread.start()
+
+    ############################################################ {{{2
+    def run(self, stream):
+        '''Worker thread function. Must not call into Vim.'''
+        pythoncom.CoInitialize()
+        try:
+            try:
+                dte = win32com.client.Dispatch(
+                        pythoncom.CoGetInterfaceAndReleaseStream(
+                            stream, pythoncom.IID_IDispatch))
+                self.result = self.func(self, dte, *self.args)
+            except Exception, e:
+                # Don't keep the traceback; its frames hold COM objects that
+                # belong to this thread
+                logger.exception(e)
+                self.error = e
+        finally:
+            dte = None
+            self.finished = time.time()
+            pythoncom.CoUninitialize()
+
+    ############################################################ {{{2
+    def wait(self, timeout, interrupted = None):
+        '''Wait at most timeout seconds (forever if timeout is 0) for the
+        operation to complete. Returns the result of the operation, or
+        re-raises its exception. On timeout the operation is cancelled, and
+        DTETimeout is raised. The wait is done in short steps; between them,
+        interrupted() is called if given, and if it returns True, or on
+        KeyboardInterrupt, the operation is cancelled and DTEInterrupted is
+        raised.'''
+        while self.thread.isAlive():
+            if timeout and self.duration >= timeout:
+                self.timed_out = True
+                self.cancel()
+                raise DTETimeout(self.name, timeout)
+            try:
+                self.thread.join(0.1)
+                if (self.thread.isAlive() and interrupted is not None and
+                        interrupted()):
+                    raise KeyboardInterrupt
+            except KeyboardInterrupt:
+                self.cancel()
+                raise DTEInterrupted(self.name)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    ############################################################ {{{2
+    def cancel(self):
+        '''Ask the operation to stop at its next cancellation point.'''
+        self.cancelled.set()
+
 ############################################################ {{{1
 class WScriptShell:
     def __init__(self):
-        self.__wsh = win32com.client.Dispatch("WScript.Shell")
+        self.__wsh = None
 
     def __call__(self, *args, **kw):
+        # Create the WScript.Shell object on first use
+        if self.__wsh is None:
+            self.__wsh = win32com.client.Dispatch("WScript.Shell")
         return self.__wsh
 
 ############################################################ {{{1
@@ -679,10 +2208,12 @@ class VimExt:
 
     @classmethod
     ############################################################ {{{2
-    def command(cls, command):
+    def command(cls, command, raw = False):
         '''Send an Ex command to Vim using vim.command(). vim.command() is
-        wrapped for standalone usage.'''
-        command = command.replace("\\\\", "\\")
+        wrapped for standalone usage. Backslashes doubled by repr() are
+        collapsed unless raw is set.'''
+        if not raw:
+            command = command.replace("\\\\", "\\")
         log_func()
         if 'vim' in globals():
             vim.command(command)
@@ -697,6 +2228,18 @@ class VimExt:
         log_func()
         return vim.eval(expr)
 
+    @classmethod
+    ############################################################ {{{2
+    def interrupted(cls):
+        '''Check if the user has typed Ctrl-C or <Esc>. Other keys typed
+        while Vim waits for Visual Studio are discarded.'''
+        if 'vim' not in globals():
+            return False
+        try:
+            return vim.eval("getchar(0)") in ("3", "27")
+        except KeyboardInterrupt:
+            return True
+
     @classmethod
     ############################################################ {{{2
     def set_var(cls, var, value):
@@ -704,6 +2247,15 @@ class VimExt:
         log_func()
         VimExt.command("let %s = %s" % (var, value))
 
+    @classmethod
+    ############################################################ {{{2
+    def let(cls, var, value):
+        '''Set a Vim variable to a Python value converted with to_vim().
+        The command is sent raw, so paths like \\\\server\\share are kept
+        intact.'''
+        log_func()
+        VimExt.command("let %s = %s" % (var, to_vim(value)), raw = True)
+
     @classmethod
     ############################################################ {{{2
     def get_var(cls, var):
@@ -769,6 +2321,129 @@ class VimExt:
 wsh = WScriptShell()
 dte = DTEWrapper()
 
+############################################################ {{{1
+# Worker functions
+# Functions that run as part of a DTEOperation in a worker thread. They
+# receive the operation and the worker's DTE object, and must not call into
+# Vim.
+def read_window(operation, dte, caption):
+    '''Returns the text in a tool window. For the Output window, the text
+    in the Build pane is returned.'''
+    window = dte.Windows.Item(caption)
+    if caption == "Output":
+        sel = window.Object.OutputWindowPanes.Item("Build").\
+            TextDocument.Selection
+    else:
+        sel = window.Selection
+    sel.SelectAll()
+    text = sel.Text.replace('\r', '')
+    sel.Collapse()
+    return text
+
+def cancel_build(operation, dte):
+    '''Cancel the build in progress. Returns False if no build is in
+    progress.'''
+    build = dte.Solution.SolutionBuild
+    if build.BuildState != vsBuildStateInProgress:
+        return False
+    build.Cancel()
+    return True
+
+def wait_for_build(operation, dte, monitor = None, start_timeout = 2.0):
+    '''Wait for Visual Studio to complete the build, and let the monitor
+    follow the build output every 0.1 seconds, so project times are not
+    rounded to whole seconds. Returns early if the operation is
+    cancelled. Builds are started without waiting for them, so first wait
+    at most start_timeout seconds for the build to be in progress;
+    otherwise the state of the previous build would be read.'''
+    build = dte.Solution.SolutionBuild
+    started = time.time()
+    try:
+        while (build.BuildState != vsBuildStateInProgress and
+                time.time() - started < start_timeout):
+            if operation.cancelled.isSet():
+                break
+            time.sleep(0.05)
+        while build.BuildState == vsBuildStateInProgress:
+            if operation.cancelled.isSet():
+                break
+            if monitor is not None:
+                monitor.poll(dte)
+            time.sleep(0.1)
+    except Exception, e:
+        logger.exception(e)
+    if monitor is not None:
+        monitor.poll(dte, True)
+
+def build_configurations(operation, dte, configurations):
+    '''Build the solution in each of the named configurations in turn, and
+    restore the active configuration afterwards. Returns a list of
+    (configuration, output, BuildMonitor) tuples; output is None if there is
+    no such configuration.'''
+    build = dte.Solution.SolutionBuild
+    active = get_configuration_name(build.ActiveConfiguration)
+    solution_configurations = dict(
+            (get_configuration_name(c), c)
+            for c in build.SolutionConfigurations)
+
+    results = []
+    try:
+        for name in configurations:
+            if operation.cancelled.isSet():
+                break
+            configuration = solution_configurations.get(name)
+            if configuration is None:
+                results.append((name, None, None))
+                continue
+
+            configuration.Activate()
+            monitor = BuildMonitor()
+            build.Build(0)
+            wait_for_build(operation, dte, monitor)
+            monitor.finish(build.LastBuildInfo)
+            results.append((name,
+                read_window(operation, dte, "Output"),
+                monitor))
+    finally:
+        if active in solution_configurations:
+            solution_configurations[active].Activate()
+    return results
+
+def read_code_models(operation, dte, paths):
+    '''Returns a list of (path, symbols) pairs for files in the solution;
+    symbols are (name, full name, kind, line) tuples from the file's code
+    model.'''
+    solution = dte.Solution
+    results = []
+    for path in paths:
+        if operation.cancelled.isSet():
+            break
+        symbols = []
+        try:
+            item = solution.FindProjectItem(path)
+            if item is not None and item.FileCodeModel is not None:
+                model = dispatch(item.FileCodeModel)
+                add_code_elements(symbols, model.CodeElements)
+        except Exception, e:
+            logger.exception(e)
+        results.append((path, symbols))
+    return results
+
+def add_code_elements(symbols, elements):
+    '''Recursive function that adds the symbols in a CodeElements
+    collection to a list.'''
+    for element in elements:
+        try:
+            kind = code_element_kinds.get(element.Kind)
+            if kind is None:
+                continue
+            symbols.append((element.Name, element.FullName, kind,
+                element.StartPoint.Line))
+            if kind in code_element_containers:
+                add_code_elements(symbols, element.Children)
+        except Exception, e:
+            logger.debug("Failed to read code element: %s" % e)
+
 ############################################################ {{{1
 # Entry point function
 def dte_execute(name, *args):
@@ -780,27 +2455,143 @@ def dte_execute(name, *args):
         function = getattr(dte, name)
         function(*args)
 
+def dte_execute_batch(operations):
+    '''Wrapper function for calling several functions in the global DTE
+    object in one call. operations is a list of [name, arg, ...] lists.
+    COM lookups are shared between the functions. s:batch_results is set to
+    a list with the result of each function; None if the function has no
+    result or fails. A failing function doesn't stop the rest.'''
+
+    results = []
+    dte.begin_batch()
+    try:
+        for operation in operations:
+            name, args = operation[0], operation[1:]
+            if not hasattr(dte, name):
+                VimExt.echoerr("No such function %s." % name)
+                results.append(None)
+                continue
+            try:
+                function = getattr(dte, name)
+                results.append(function(*args))
+            except Exception, e:
+                logger.exception(e)
+                VimExt.echowarn("Failed to execute %s." % name)
+                results.append(None)
+    finally:
+        dte.end_batch()
+    VimExt.let("s:batch_results", results)
+
 def dte_cleanup():
-    logger.removeHandler(fh)
+    if log_level > 0:
+        logger.removeHandler(fh)
 
 ############################################################ {{{2
 # Global helper functions
-import inspect
 def func_name():
-    return inspect.stack()[1][3]
+    return sys._getframe(1).f_code.co_name
+
+def dispatch(obj):
+    '''Returns a DispatchProxy for a COM object. DISPIDs are loaded from
+    makepy generated modules the first time.'''
+    if not DispatchProxy.type_libraries_loaded:
+        DispatchProxy.load_type_libraries(makepy_type_libraries)
+    return DispatchProxy(obj._oleobj_)
+
+def to_vim(value):
+    '''Returns a Vim expression for a Python value. None and booleans are
+    converted to numbers.'''
+    if value is None:
+        return "0"
+    elif isinstance(value, bool):
+        return str(int(value))
+    elif isinstance(value, (int, long, float)):
+        return repr(value)
+    elif isinstance(value, basestring):
+        if isinstance(value, unicode):
+            value = value.encode("utf-8")
+        return "'%s'" % value.replace("'", "''")
+    elif isinstance(value, dict):
+        return "{%s}" % ", ".join(["%s: %s" % (to_vim(str(k)), to_vim(v))
+            for k, v in value.items()])
+    else:
+        return "[%s]" % ", ".join([to_vim(v) for v in value])
+
+def percentile(values, p):
+    '''Returns the pth percentile of values (nearest rank).'''
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank - 1, 0)]
+
+def get_configuration_name(configuration):
+    '''Returns the "Configuration|Platform" name of a solution
+    configuration.'''
+    return "%s|%s" % (configuration.Name, configuration.PlatformName)
+
+def is_source_file(filename):
+    return os.path.splitext(filename)[1].lower() in (
+            ".c", ".cc", ".cpp", ".cxx")
+
+def is_code_file(filename):
+    return is_source_file(filename) or \
+        os.path.splitext(filename)[1].lower() in (
+                ".h", ".hh", ".hpp", ".hxx", ".inl", ".cs")
+
+def get_compile_commands(project):
+    '''Returns compile_commands.json entries for the settings and files of
+    a project as stored by export_compile_commands.'''
+    settings = project["settings"]
+    arguments = ["cl.exe", "/nologo", "/c"]
+    arguments += ["/I%s" % i for i in settings["includes"]]
+    arguments += ["/D%s" % d for d in settings["defines"]]
+    arguments += ["/FI%s" % f for f in settings["forced_includes"]]
+    arguments += settings["options"]
+    return [{"directory": settings["directory"],
+            "file": f,
+            "arguments": arguments + [f]} for f in project["files"]]
+
+def get_cache_file(solution_name, kind, extension = "json"):
+    '''Returns the name of a cache file in the temp directory for the
+    solution.'''
+    digest = hashlib.md5(solution_name.lower()).hexdigest()[:12]
+    return os.path.join(
+            tempfile.gettempdir(),
+            "visual_studio_%s_%s.%s" % (kind, digest, extension))
+
+def load_json(filename, default):
+    try:
+        f = open(filename, "r")
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError), e:
+        return default
+
+def save_json(filename, data):
+    f = open(filename, "w")
+    try:
+        json.dump(data, f, indent = 2)
+    finally:
+        f.close()
 
 def log_func():
     def kv_to_str(k, v):
         return str(k) + ", " + str(v)
 
+    # Don't inspect the stack if nothing is logged
+    if log_level == 0:
+        return
+    import inspect
+
     # get the stack frame of the previous function
-    frame = inspect.stack()[1]
+    frame = sys._getframe(1)
 
     # function name
-    func_name = frame[3]
+    func_name = frame.f_code.co_name
 
     # convert argument dict to a comma separated string
-    arg_info = inspect.getargvalues(frame[0])
+    arg_info = inspect.getargvalues(frame)
 
     # remove 'self' argument
     if 'self' in arg_info.args:
@@ -52,12 +52,6 @@ if version < 700
     finish
 endif
 
-if !has("python")
-    echomsg "visual_studio.vim plugin requires a Vim compiled with Python" .
-        \ "support, and that the correct version of Python is installed."
-    finish
-endif
-
 scriptencoding utf-8
 
 "----------------------------------------------------------------------
@@ -108,6 +102,14 @@ call s:InitVariable("g:visual_studio_project_submenus", 1)
 call s:InitVariable("g:visual_studio_commands", 1)
 call s:InitVariable("g:visual_studio_mappings", 1)
 call s:InitVariable("g:visual_studio_log_level", 0)
+call s:InitVariable("g:visual_studio_update_symbols_on_write", 1)
+" Deadlines in seconds for operations in Visual Studio; 'call' applies to
+" operations without a deadline of their own. 0 means no deadline.
+call s:InitVariable("g:visual_studio_timeout", {})
+call s:InitVariable("g:visual_studio_timeout['call']", 10)
+call s:InitVariable("g:visual_studio_timeout['compile']", 600)
+call s:InitVariable("g:visual_studio_timeout['build']", 3600)
+call s:InitVariable("g:visual_studio_timeout['symbols']", 60)
 
 "----------------------------------------------------------------------
 " Local variables {{{2
@@ -117,20 +119,33 @@ call s:InitVariable("s:location", expand("<sfile>:h"))
 call s:InitVariable("s:solutions", [])
 call s:InitVariable("s:projects", [])
 call s:InitVariable("s:project_tree", [])
+call s:InitVariable("s:project_trees", {})
 call s:InitVariable("s:solution_index", -1)
 call s:InitVariable("s:project_index", -1)
 call s:InitVariable("s:output", $TEMP . '\vs_output.txt')
 call s:InitVariable("s:command_status", 0)
+call s:InitVariable("s:log_file", "")
+call s:InitVariable("s:matrix_results", [])
+call s:InitVariable("s:symbols", [])
+call s:InitVariable("s:batch_results", [])
 
 "----------------------------------------------------------------------
 " Initialization {{{1
 
 "----------------------------------------------------------------------
 " Initialization function {{{2
-" Import visual_studio.py
+" Import visual_studio.py. Python is initialized on the first command that
+" needs it rather than when the plugin is loaded, so that the plugin costs
+" next to nothing at startup. Returns 0 if Python is not available.
 function! s:PythonInit()
     if s:python_init
-        return
+        return 1
+    endif
+
+    if !has("python")
+        echomsg "visual_studio.vim plugin requires a Vim compiled with Python" .
+            \ "support, and that the correct version of Python is installed."
+        return 0
     endif
 
     python import sys
@@ -138,12 +153,9 @@ function! s:PythonInit()
     exe 'python import ' . s:module
 
     let s:python_init = 1
+    return 1
 endfunction
 
-"----------------------------------------------------------------------
-" Plugin initialization {{{2
-call s:PythonInit()
-
 
 "----------------------------------------------------------------------
 " Python module access functions {{{1
@@ -153,6 +165,10 @@ call s:PythonInit()
 " Execute a function in the visual_studio.py module with the supplied
 " arguments.
 function! s:DTEExec(py_func, ...)
+    if !s:PythonInit()
+        return
+    endif
+
     " All functions except update_solution_list and set_current_dte require a
     " solution to be selected. If no solution is selected, select the default
     " one
@@ -173,6 +189,34 @@ function! s:DTEExec(py_func, ...)
     exe printf("python %s.dte_execute(%s)", s:module, pyargs)
 endfunction
 
+"----------------------------------------------------------------------
+" Execute several python functions {{{2
+" Execute a list of functions, given as [py_func, arg, ...] lists, in the
+" visual_studio.py module in one call. COM lookups are shared between the
+" functions. Returns a list with the result of each function.
+function! s:DTEExecBatch(operations)
+    let s:batch_results = []
+    if !s:PythonInit()
+        return s:batch_results
+    endif
+
+    " See s:DTEExec
+    for operation in a:operations
+        if index(["update_solution_list", "set_current_dte"],
+                \ operation[0]) == -1
+            if !s:SolutionIsSelected()
+                return s:batch_results
+            endif
+            break
+        endif
+    endfor
+
+    " Call the python function
+    exe printf("python %s.dte_execute_batch(%s.VimExt.eval('a:operations'))",
+        \ s:module, s:module)
+    return s:batch_results
+endfunction
+
 
 "----------------------------------------------------------------------
 " Debug functions {{{1
@@ -182,6 +226,9 @@ endfunction
 " Force a reload of visual_studio.py. Useful when making modifications to
 " visual_studio.py.
 function! DTEReload()
+    if !s:PythonInit()
+        return
+    endif
     exe "python " . s:module . ".dte_cleanup()"
     exe "python import " . s:module
     exe "python reload(" . s:module . ")"
@@ -201,6 +248,14 @@ function! DTELogFile()
 endfunction
 
 
+"----------------------------------------------------------------------
+" Display operation metrics {{{2
+" Echo call counts, durations and timeouts of operations in Visual Studio.
+function! DTEOperationStats()
+    call s:DTEExec("show_operation_metrics")
+endfunction
+
+
 "----------------------------------------------------------------------
 " Single file operations {{{1
 
@@ -353,8 +408,14 @@ endfunction
 "----------------------------------------------------------------------
 " Load error file {{{2
 " Load output, task list or find results from Visual Studio into the quickfix
-" list or a location list. 
-function! s:DTELoadErrorFile(type)
+" list or a location list. The output file can optionally be specified.
+function! s:DTELoadErrorFile(type, ...)
+    if a:0 > 0
+        let output = a:1
+    else
+        let output = s:output
+    endif
+
     " save errorformat
     let saveefm = &errorformat
 
@@ -373,14 +434,41 @@ function! s:DTELoadErrorFile(type)
     endif
 
     if g:visual_studio_use_location_list
-        exe "lgetfile " . s:output
+        exe "lgetfile " . output
     else
-        exe "cgetfile " . s:output
+        exe "cgetfile " . output
     endif
 
     " restore errorformat
     let &errorformat = saveefm
 endfunction
+
+"----------------------------------------------------------------------
+" Load matrix build results {{{2
+" Load the output of each configuration in a matrix build and merge it into
+" one quickfix list or location list, tagging each entry with its
+" configuration.
+function! s:DTELoadMatrixResults()
+    let entries = []
+    for [configuration, output] in s:matrix_results
+        call s:DTELoadErrorFile("Output", output)
+        if g:visual_studio_use_location_list
+            let items = getloclist(0)
+        else
+            let items = getqflist()
+        endif
+        for item in items
+            let item.text = "[" . configuration . "] " . item.text
+        endfor
+        call extend(entries, items)
+    endfor
+
+    if g:visual_studio_use_location_list
+        call setloclist(0, entries)
+    else
+        call setqflist(entries)
+    endif
+endfunction
         
 "----------------------------------------------------------------------
 " Open error window {{{2
@@ -448,6 +536,146 @@ function! DTEBuildSolution()
     endif
 endfunction
 
+"----------------------------------------------------------------------
+" Build matrix {{{2
+" Build the solution in several configurations, e.g. Debug|Win32 and
+" Release|x64, concurrently in all Visual Studio instances with the current
+" solution open. If no configurations are supplied, build all solution
+" configurations.
+function! DTEBuildMatrix(...)
+    if g:visual_studio_write_before_build
+        wall
+    endif
+
+    call s:DTEExec("build_matrix", escape(s:output, '\'), join(a:000, ","))
+    if s:command_status
+        call s:DTELoadMatrixResults()
+        call s:DTEQuickfixOpen()
+    endif
+endfunction
+
+"----------------------------------------------------------------------
+" Build history {{{2
+" Display a report on the recorded builds of the current solution: the
+" slowest projects (default), regressions, or percentiles.
+function! DTEBuildHistory(...)
+    if a:0 >= 1
+        call s:DTEExec("show_build_history", a:1)
+    else
+        call s:DTEExec("show_build_history")
+    endif
+    call input("Press <Enter> to continue ...")
+endfunction
+
+"----------------------------------------------------------------------
+" Build history report completion {{{2
+" Command line completion on build history report names.
+function! s:CompleteBuildHistory(ArgLead, CmdLine, CursorPos)
+    return filter(["slowest", "regressions", "percentiles"],
+        \ "v:val =~ '^' . a:ArgLead")
+endfunction
+
+"----------------------------------------------------------------------
+" Cancel build {{{2
+" Cancel the build in progress in Visual Studio. While Vim waits for a build
+" or another operation in Visual Studio, Ctrl-C or <Esc> cancels it as well.
+function! DTECancelBuild()
+    call s:DTEExec("cancel_build")
+endfunction
+
+"----------------------------------------------------------------------
+" Export compile commands {{{2
+" Write a compile_commands.json for the active configuration of the current
+" solution. If no file name is supplied, the file is written to the solution
+" directory. If force is non-zero, all projects are queried again instead of
+" only the projects whose project files or property sheets have changed.
+function! DTECompileCommands(force, ...)
+    if a:0 >= 1
+        call s:DTEExec("export_compile_commands", a:force,
+            \ escape(fnamemodify(a:1, ":p"), '\'))
+    else
+        call s:DTEExec("export_compile_commands", a:force)
+    endif
+endfunction
+
+"----------------------------------------------------------------------
+" Symbol functions {{{1
+
+"----------------------------------------------------------------------
+" Update symbols {{{2
+" Update the symbol index of the current solution from the code model. Only
+" files modified since they were last indexed are read.
+function! DTEUpdateSymbols()
+    call s:DTEExec("update_symbol_index")
+endfunction
+
+"----------------------------------------------------------------------
+" Update symbols of a file {{{2
+" Update the symbols of a file in the symbol index after it has been
+" written. Does nothing unless a solution has been selected, so that writing
+" a file never loads Python or connects to Visual Studio.
+function! s:UpdateSymbolFile(filename)
+    if !s:python_init || s:solution_index == -1
+        return
+    endif
+    call s:DTEExec("update_symbol_file", escape(a:filename, '\"'))
+endfunction
+
+"----------------------------------------------------------------------
+" Go to symbol {{{2
+" Jump to the definition of a symbol in the symbol index. Names are matched
+" on prefix first, then fuzzily; if several symbols match, select one from a
+" list.
+function! DTEGotoSymbol(name)
+    let s:symbols = []
+    call s:DTEExec("find_symbols", escape(a:name, '\"'))
+    if empty(s:symbols)
+        echo "No symbols found: " . a:name
+        return
+    endif
+
+    if len(s:symbols) == 1
+        let index = 0
+    else
+        let menu = ["Select symbol:"]
+        let i = 1
+        for [name, full_name, kind, path, line] in s:symbols
+            call add(menu, printf("%2d %-10s %s (%s:%d)", i, kind, full_name,
+                \ fnamemodify(path, ":t"), line))
+            let i += 1
+        endfor
+        let index = inputlist(menu) - 1
+        redraw
+    endif
+
+    if index >= 0 && index < len(s:symbols)
+        let [name, full_name, kind, path, line] = s:symbols[index]
+        if &modified && !&hidden && !&autowriteall
+            exe "split +" . line . " " . fnameescape(path)
+        else
+            exe "edit +" . line . " " . fnameescape(path)
+        endif
+    endif
+endfunction
+
+"----------------------------------------------------------------------
+" Symbol completion {{{2
+" Command line completion on symbol names in the symbol index.
+function! s:CompleteSymbol(ArgLead, CmdLine, CursorPos)
+    if a:ArgLead == ""
+        return []
+    endif
+    let s:symbols = []
+    call s:DTEExec("find_symbols", escape(a:ArgLead, '\"'))
+    let result = []
+    for symbol in s:symbols
+        if index(result, symbol[0]) == -1
+            call add(result, symbol[0])
+        endif
+    endfor
+    return result
+endfunction
+
 "----------------------------------------------------------------------
 " Solution functions {{{1
 
@@ -535,13 +763,23 @@ endfunc
 " Refresh the solution menu {{{2
 " Refresh the VisualStudio.Solutions menu, and display the popup menu.
 function! s:MenuRefreshSolutions()
-    " Populate s:solutions
-    call s:DTEGetInstances()
+    " Populate s:solutions, and if a solution is selected, s:projects and
+    " s:project_trees, in one call
+    let s:solutions = []
+    if s:solution_index != -1
+        let s:projects = []
+        let s:project_trees = {}
+        call s:DTEExecBatch([["update_solution_list"]] +
+            \ s:ProjectOperations())
+        call s:UpdateProjectMenu()
+    else
+        call s:DTEExecBatch([["update_solution_list"]])
+    endif
+    call s:UpdateSolutionMenu()
     if len(s:solutions) == 0
         echo "No Visual Studio instances found"
     else
         echo "Found " . len(s:solutions) . " solutions"
-        call s:UpdateSolutionMenu()
         popup! VisualStudio.Solutions
     endif
 endfunc
@@ -579,10 +817,14 @@ function! s:SelectSolutionByIndex(index)
     endif
     "if a:index != s:solution_index
         let s:solution_index = a:index
-        call s:DTEExec("set_current_dte", s:GetSolutionPID())
+        let s:projects = []
+        let s:project_trees = {}
+        " The following call will populate s:projects and s:project_trees
+        call s:DTEExecBatch([["set_current_dte", s:GetSolutionPID()]] +
+            \ s:ProjectOperations())
         call s:UpdateSolutionMenu()
     "endif
-    call s:DTEGetProjects()
+    call s:UpdateProjectMenu()
     return 1
 endfunction
 
@@ -721,11 +963,11 @@ endfunc
 " Refresh the VisualStudio.Projects menu for the current solution,
 " and display the popup menu.
 function! s:MenuRefreshProjects()
+    call s:DTEGetProjects()
     if len(s:projects) == 0
         echo "No projects found in solution"
     else
         echo "Found " . len(s:projects) . " projects"
-        call s:UpdateProjectMenu()
         popup! VisualStudio.Projects
     endif
 endfunc
@@ -747,11 +989,24 @@ endfunc
 " Get the projects in the current solution and add them to the project list.
 function! s:DTEGetProjects()
     let s:projects = []
-    " The following call will populate s:projects
-    call s:DTEExec("update_project_list")
+    let s:project_trees = {}
+    " The following call will populate s:projects and s:project_trees
+    call s:DTEExecBatch(s:ProjectOperations())
     call s:UpdateProjectMenu()
 endfunction
 
+"----------------------------------------------------------------------
+" Get project operations {{{2
+" Get the operations that update the project list and, if the project sub
+" menus are enabled, the project trees.
+function! s:ProjectOperations()
+    let operations = [["update_project_list"]]
+    if g:visual_studio_menu && g:visual_studio_project_submenus
+        call add(operations, ["update_project_trees"])
+    endif
+    return operations
+endfunction
+
 "----------------------------------------------------------------------
 " Select Visual Studio startup project {{{2
 " Select a Visual Studio startup project by supplying its index. Update the
@@ -781,6 +1036,12 @@ function! s:UpdateProjectMenu()
     catch
     endtry
 
+    if g:visual_studio_project_submenus && empty(s:project_trees) &&
+        \ len(s:projects) > 0
+        " Fetch all trees in one call rather than one call per project
+        call s:DTEExec("update_project_trees")
+    endif
+
     for i in range(len(s:projects))
         let selected = (s:project_index == i)
         let item = "&VisualStudio.Pro&jects." .
@@ -808,6 +1069,9 @@ function! s:UpdateProjectMenu()
             endfor
         endif
     endfor
+    " The menus hold the file names; don't keep the trees for the session
+    let s:project_trees = {}
+    let s:project_tree = []
 
     if len(s:projects) > 0
         amenu <silent> .810 &VisualStudio.Pro&jects.-separator- :
@@ -855,15 +1119,21 @@ endfunction
 "----------------------------------------------------------------------
 " Get project children {{{2
 " Get the children of the project with the supplied index. If index is
-" unspecified, get the children of the current project.
+" unspecified, get the children of the current project. Project trees are
+" fetched together with the project list, and only fetched here if missing.
+" s:UpdateProjectMenu clears the trees once the menus are built.
 function! s:GetProjectChildren(...)
     if a:0 > 0 
         let index = a:1
     else
         let index = s:project_index
     endif
-    call s:DTEExec("update_project_tree", s:GetProjectName(index))
-    return get(s:project_tree, 1, [])
+    let name = s:GetProjectName(index)
+    if !has_key(s:project_trees, name)
+        call s:DTEExec("update_project_tree", name)
+        let s:project_trees[name] = s:project_tree
+    endif
+    return get(s:project_trees[name], 1, [])
 endfunction
 
 "----------------------------------------------------------------------
@@ -936,8 +1206,17 @@ if has("gui") && g:visual_studio_menu
     amenu <silent> &VisualStudio.&Build\ Solution :call DTEBuildSolution()<CR>
     amenu <silent> &VisualStudio.Build\ Start&up\ Project
         \ :call DTEBuildProject()<CR>
+    amenu <silent> &VisualStudio.Build\ &Matrix :call DTEBuildMatrix()<CR>
     amenu <silent> &VisualStudio.&Compile\ File :call DTECompileFile()<CR>
+    amenu <silent> &VisualStudio.Cance&l\ Build :call DTECancelBuild()<CR>
+    amenu <silent> &VisualStudio.Build\ &History :call DTEBuildHistory()<CR>
+    amenu <silent> &VisualStudio.E&xport\ Compile\ Commands
+        \ :call DTECompileCommands(0)<CR>
     amenu <silent> &VisualStudio.-separator3- :<CR>
+    amenu <silent> &VisualStudio.Up&date\ Symbols :call DTEUpdateSymbols()<CR>
+    amenu <silent> &VisualStudio.Go\ to\ S&ymbol
+        \ :call DTEGotoSymbol(expand("<cword>"))<CR>
+    amenu <silent> &VisualStudio.-separator5- :<CR>
     call s:UpdateSolutionMenu()
     call s:UpdateProjectMenu()
     amenu <silent> .900 &VisualStudio.-separator4- :<CR>
@@ -955,7 +1234,14 @@ nnoremap <silent> <Plug>VSFindResults1 :call DTEFindResults(1)<CR>
 nnoremap <silent> <Plug>VSFindResults2 :call DTEFindResults(2)<CR>
 nnoremap <silent> <Plug>VSBuildSolution :call DTEBuildSolution()<CR>
 nnoremap <silent> <Plug>VSBuildProject :call DTEBuildProject()<CR>
+nnoremap <silent> <Plug>VSBuildMatrix :call DTEBuildMatrix()<CR>
 nnoremap <silent> <Plug>VSCompileFile :call DTECompileFile()<CR>
+nnoremap <silent> <Plug>VSCancelBuild :call DTECancelBuild()<CR>
+nnoremap <silent> <Plug>VSBuildHistory :call DTEBuildHistory()<CR>
+nnoremap <silent> <Plug>VSCompileCommands :call DTECompileCommands(0)<CR>
+nnoremap <silent> <Plug>VSUpdateSymbols :call DTEUpdateSymbols()<CR>
+nnoremap <silent> <Plug>VSGotoSymbol
+    \ :call DTEGotoSymbol(expand("<cword>"))<CR>
 nnoremap <silent> <Plug>VSSelectSolution :call DTESelectSolution()<CR>
 nnoremap <silent> <Plug>VSSelectProject :call DTESelectProject()<CR>
 nnoremap <silent> <Plug>VSListFiles :call DTEListFiles()<CR>
@@ -975,6 +1261,8 @@ if g:visual_studio_mappings
     nmap <silent> <Leader>vb <Plug>VSBuildSolution
     nmap <silent> <Leader>vu <Plug>VSBuildProject
     nmap <silent> <Leader>vc <Plug>VSCompileFile
+    nmap <silent> <Leader>vx <Plug>VSCancelBuild
+    nmap <silent> <Leader>vd <Plug>VSGotoSymbol
     nmap <silent> <Leader>vs <Plug>VSSelectSolution
     nmap <silent> <Leader>vj <Plug>VSSelectProject
     nmap <silent> <Leader>vl <Plug>VSListFiles
@@ -998,7 +1286,13 @@ if g:visual_studio_commands
         \ DTEListFiles call DTEListFiles(<f-args>)
     com! -nargs=* -complete=customlist,s:CompleteProject
         \ DTEGetFiles call DTEGetFiles(<f-args>)
+    com! -nargs=* DTEBuildMatrix call DTEBuildMatrix(<f-args>)
     com! DTECompileFile call DTECompileFile()
+    com! DTECancelBuild call DTECancelBuild()
+    com! -nargs=? -complete=customlist,s:CompleteBuildHistory
+        \ DTEBuildHistory call DTEBuildHistory(<f-args>)
+    com! -bang -nargs=? -complete=file
+        \ DTECompileCommands call DTECompileCommands(<bang>0, <f-args>)
     com! -nargs=* -complete=customlist,s:CompleteSolution
         \ DTESelectSolution call DTESelectSolution(<f-args>)
     com! DTEListSolutions call DTEListSolutions()
@@ -1010,6 +1304,20 @@ if g:visual_studio_commands
     com! DTEHelp call DTEOnline()
     com! DTEReload call DTEReload()
     com! DTELogFile call DTELogFile()
+    com! DTEOperationStats call DTEOperationStats()
+    com! DTEUpdateSymbols call DTEUpdateSymbols()
+    com! -nargs=1 -complete=customlist,s:CompleteSymbol
+        \ DTEGotoSymbol call DTEGotoSymbol(<f-args>)
+endif
+
+"----------------------------------------------------------------------
+" Autocommand setup {{{2
+if g:visual_studio_update_symbols_on_write
+    augroup visual_studio
+        autocmd!
+        autocmd BufWritePost *.c,*.cc,*.cpp,*.cxx,*.h,*.hh,*.hpp,*.hxx,*.inl,*.cs
+            \ call s:UpdateSymbolFile(expand("<afile>:p"))
+    augroup END
 endif
 
 " vim: set sts=4 sw=4 fdm=marker:
@@ -0,0 +1,87 @@
+'''project_tree_memory.py - Measure the memory used by a project tree
+
+Usage:
+    python test/project_tree_memory.py [directories [files]]
+
+A synthetic project with 50 top level folders, each with 'directories' sub
+folders (default 40) holding 'files' files (default 50), is stored both as
+the nested lists returned by the old DTEWrapper.get_project_tree and as a
+ProjectTree. Paths are about 80 characters long, and the files of a sub
+folder share their directory. Sizes are measured with a recursive
+sys.getsizeof; strings shared between objects are counted once.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "plugin"))
+from visual_studio import ProjectTree
+
+############################################################ {{{1
+def deep_size(obj, seen):
+    '''Returns the size of obj and of the objects it refers to that have not
+    been seen yet.'''
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(obj.__dict__, seen)
+    return size
+
+def build(directories, files):
+    '''Returns the nested list tree, the ProjectTree and the file count of
+    the synthetic project.'''
+    root = "C:\\src\\company\\product\\components"
+    tree = ProjectTree()
+    tree_root = tree.add(-1, "project")
+    nested = ["project", []]
+    count = 0
+    for a in range(50):
+        name = "module%d" % a
+        tree_a = tree.add(tree_root, name)
+        nested_a = [name, []]
+        nested[1].append(nested_a)
+        for b in range(directories):
+            name = "subsystem%d" % b
+            tree_b = tree.add(tree_a, name)
+            nested_b = [name, []]
+            nested_a[1].append(nested_b)
+            directory = "%s\\module_%03d\\subsystem_%03d\\source\\" % \
+                    (root, a, b)
+            for c in range(files):
+                name = "implementation_file_%03d_%03d_%03d.cpp" % (a, b, c)
+                # The old tree got a new string from every str() call
+                tree.add(tree_b, name, directory + name)
+                nested_b[1].append([str(name), directory + name])
+                count += 1
+    return nested, tree, count
+
+def main(argv):
+    directories = 40
+    files = 50
+    if len(argv) > 1:
+        directories = int(argv[1])
+    if len(argv) > 2:
+        files = int(argv[2])
+
+    nested, tree, count = build(directories, files)
+    assert tree.to_list() == nested
+
+    nested_size = deep_size(nested, set())
+    building_size = deep_size(tree, set())
+    tree.freeze()
+    frozen_size = deep_size(tree, set())
+    print "%d files" % count
+    print "  nested lists: %.1f MB" % (nested_size / 1e6)
+    print "  ProjectTree:  %.1f MB after freeze(), %.1f MB while building" % \
+            (frozen_size / 1e6, building_size / 1e6)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,56 @@
+" startup_time.vim - Measure the time it takes to load visual_studio.vim
+"
+" Usage:
+"   vim -u NONE -N -es --cmd "let g:startup_output = 'times.txt'"
+"       \ -S test/startup_time.vim
+"
+" Options, set with --cmd before the script is sourced:
+"   g:startup_plugin  The plugin to load; default plugin/visual_studio.vim
+"                     next to this directory. visual_studio.py is taken from
+"                     the same directory.
+"   g:startup_runs    Number of loads; default 20
+"   g:startup_output  File to append the results to; default none (echo)
+"
+" The plugin is copied to a temporary directory with its platform guard
+" removed, so that it loads on any platform. The first load is the one Vim
+" pays at startup; later loads show the cost of sourcing the script alone.
+" To compare with an earlier version, extract it first, e.g.
+"   git show <commit>:plugin/visual_studio.vim > old/visual_studio.vim
+"   git show <commit>:plugin/visual_studio.py > old/visual_studio.py
+
+let s:plugin = exists("g:startup_plugin") ? g:startup_plugin :
+    \ expand("<sfile>:p:h:h") . "/plugin/visual_studio.vim"
+let s:runs = exists("g:startup_runs") ? g:startup_runs : 20
+
+let s:dir = tempname()
+call mkdir(s:dir)
+let s:lines = readfile(s:plugin)
+let s:guard = index(s:lines, 'if !has("win32") && !has("win64")')
+if s:guard >= 0
+    call remove(s:lines, s:guard, s:guard + 2)
+endif
+call writefile(s:lines, s:dir . "/visual_studio.vim")
+let s:module = fnamemodify(s:plugin, ":r") . ".py"
+if filereadable(s:module)
+    call writefile(readfile(s:module, "b"), s:dir . "/visual_studio.py", "b")
+endif
+
+" Load the copy; visual_studio_debug lets it be sourced again
+let g:visual_studio_debug = 1
+let s:times = []
+for s:i in range(s:runs)
+    let s:start = reltime()
+    exe "silent source " . fnameescape(s:dir . "/visual_studio.vim")
+    call add(s:times, 1000.0 * reltimefloat(reltime(s:start)))
+endfor
+
+let s:warm = sort(s:times[1:], "f")
+let s:result = printf("%s: first load %.2f ms, median of %d reloads %.2f ms",
+    \ s:plugin, s:times[0], len(s:warm),
+    \ empty(s:warm) ? 0.0 : s:warm[len(s:warm) / 2])
+if exists("g:startup_output")
+    call writefile([s:result], g:startup_output, "a")
+else
+    echo s:result
+endif
+qa!
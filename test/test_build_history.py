@@ -0,0 +1,208 @@
+'''Tests for BuildMonitor, BuildHistory and percentile.
+
+Run with Python 2 from the repository root:
+    python -m unittest discover -s test
+'''
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "plugin"))
+import visual_studio
+from visual_studio import BuildHistory, BuildMonitor, percentile, \
+        wait_for_build
+
+############################################################ {{{1
+class BuildMonitorTest(unittest.TestCase):
+    def test_prefixed_projects_built_concurrently(self):
+        monitor = BuildMonitor()
+        monitor.feed([
+            "1>------ Build started: Project: core, "
+                "Configuration: Debug Win32 ------",
+            "2>------ Build started: Project: ui, "
+                "Configuration: Release x64 ------",
+            "1>Compiling...",
+            "1>c:\\src\\a.cpp(3) : error C2065: 'x' : undeclared identifier",
+            "2>c:\\src\\b.cpp(4) : warning C4244: conversion",
+            "1>c:\\src\\a.cpp(4) : warning C4244: conversion",
+            ], 100.0)
+        monitor.feed([
+            "2>ui - 0 error(s), 1 warning(s)",
+            ], 110.0)
+        monitor.feed([
+            "1>Build FAILED.",
+            "========== Build: 1 succeeded, 1 failed, 0 skipped ==========",
+            ], 130.0)
+
+        ui, core = monitor.projects
+        self.assertEqual((ui["project"], ui["configuration"]),
+                ("ui", "Release|x64"))
+        self.assertEqual((ui["started"], ui["finished"]), (100.0, 110.0))
+        self.assertEqual((ui["errors"], ui["warnings"], ui["outcome"]),
+                (0, 1, "succeeded"))
+        self.assertEqual((core["project"], core["configuration"]),
+                ("core", "Debug|Win32"))
+        self.assertEqual((core["started"], core["finished"]), (100.0, 130.0))
+        self.assertEqual((core["errors"], core["warnings"], core["outcome"]),
+                (1, 1, "failed"))
+        self.assertEqual((monitor.errors, monitor.warnings), (1, 2))
+
+    def test_lines_without_prefix(self):
+        monitor = BuildMonitor()
+        monitor.feed([
+            "------ Rebuild All started: Project: core, "
+                "Configuration: Debug Win32 ------",
+            "c:\\src\\a.cpp(4) : warning C4244: conversion",
+            "core - 0 error(s), 1 warning(s)",
+            "------ Build started: Project: ui, "
+                "Configuration: Debug Win32 ------",
+            "c:\\src\\b.cpp(3) : fatal error C1083: Cannot open include file",
+            ], 10.0)
+        monitor.feed(["ui - 1 error(s), 0 warning(s)"], 15.0)
+
+        core, ui = monitor.projects
+        self.assertEqual((core["project"], core["warnings"],
+            core["outcome"]), ("core", 1, "succeeded"))
+        self.assertEqual((ui["project"], ui["errors"], ui["outcome"]),
+                ("ui", 1, "failed"))
+        self.assertEqual(ui["finished"], 15.0)
+
+    def test_finish_ends_projects_still_building(self):
+        monitor = BuildMonitor()
+        monitor.feed(["3>------ Build started: Project: core, "
+            "Configuration: Debug Win32 ------"], 1.0)
+        monitor.finish(0)
+        self.assertEqual(len(monitor.projects), 1)
+        self.assertEqual(monitor.projects[0]["outcome"], "succeeded")
+        self.assertEqual(monitor.projects[0]["finished"], monitor.finished)
+        self.assertEqual(monitor.active, {})
+
+    def test_error_lines_outside_projects_are_ignored(self):
+        monitor = BuildMonitor()
+        monitor.feed(["c:\\src\\a.cpp(3) : error C2065: 'x'"], 1.0)
+        self.assertEqual(monitor.projects, [])
+
+############################################################ {{{1
+class FakeObject:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class FakeBuild:
+    '''SolutionBuild that is in progress until the finish time.'''
+    def __init__(self, finish):
+        self.finish = finish
+
+    def __get_build_state(self):
+        if time.time() < self.finish:
+            return visual_studio.vsBuildStateInProgress
+        return visual_studio.vsBuildStateDone
+    BuildState = property(__get_build_state)
+
+class PollCounter:
+    def __init__(self):
+        self.polls = []
+
+    def poll(self, dte, final = False):
+        self.polls.append(final)
+
+class WaitForBuildTest(unittest.TestCase):
+    def test_monitor_is_polled_more_than_once_a_second(self):
+        operation = FakeObject(cancelled = threading.Event())
+        dte = FakeObject(Solution = FakeObject(
+            SolutionBuild = FakeBuild(time.time() + 0.5)))
+        monitor = PollCounter()
+        wait_for_build(operation, dte, monitor)
+        self.assertTrue(monitor.polls.count(False) >= 3)
+        self.assertEqual(monitor.polls[-1], True)
+
+############################################################ {{{1
+class PercentileTest(unittest.TestCase):
+    def test_nearest_rank(self):
+        values = range(10, 0, -1)
+        self.assertEqual(percentile(values, 50), 5)
+        self.assertEqual(percentile(values, 90), 9)
+        self.assertEqual(percentile(values, 99), 10)
+        self.assertEqual(percentile(values, 100), 10)
+        self.assertEqual(percentile(values, 0), 1)
+
+    def test_rank_is_rounded_up(self):
+        self.assertEqual(percentile([1, 2, 3], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 51), 3)
+        self.assertEqual(percentile([7], 99), 7)
+
+############################################################ {{{1
+class BuildHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.history = BuildHistory(":memory:")
+        self.time = 0.0
+
+    def record(self, duration, outcome = "succeeded", project = "core",
+            kind = "solution"):
+        monitor = BuildMonitor()
+        self.time += 1000.0
+        monitor.started = self.time
+        monitor.finished = self.time + duration + 1.0
+        monitor.failed = int(outcome == "failed")
+        monitor.projects = [{"project": project,
+            "configuration": "Debug|Win32", "started": self.time,
+            "finished": self.time + duration, "errors": 0, "warnings": 0,
+            "outcome": outcome}]
+        self.history.record("s.sln", kind, "Debug|Win32", monitor)
+
+    def test_regression_is_reported(self):
+        for duration in (10.0, 11.0, 9.0, 10.0, 14.0):
+            self.record(duration)
+        lines = self.history.regressions("s.sln")
+        # Header, project and whole build
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].startswith("(solution)"))
+        self.assertTrue(lines[2].startswith("core"))
+        self.assertTrue(lines[2].rstrip().endswith("+40%"))
+
+    def test_change_within_factor_is_not_reported(self):
+        for duration in (10.0, 11.0, 9.0, 10.0, 12.0):
+            self.record(duration)
+        self.assertEqual(self.history.regressions("s.sln"), [])
+
+    def test_change_under_a_second_is_not_reported(self):
+        for duration in (0.5, 0.5, 0.5, 0.5, 1.2):
+            self.record(duration, project = "small")
+        lines = self.history.regressions("s.sln")
+        self.assertFalse([l for l in lines if l.startswith("small")])
+
+    def test_regression_needs_four_builds(self):
+        for duration in (10.0, 10.0, 20.0):
+            self.record(duration)
+        self.assertEqual(self.history.regressions("s.sln"), [])
+
+    def test_failed_builds_are_left_out(self):
+        for duration in (10.0, 10.0, 10.0, 10.0):
+            self.record(duration)
+        self.record(30.0, "failed")
+        self.assertEqual(self.history.regressions("s.sln"), [])
+        self.assertEqual(self.history.durations("s.sln")[
+            ("core", "Debug|Win32")], [10.0] * 4)
+
+    def test_matrix_builds_of_projects_are_left_out(self):
+        for duration in (10.0, 10.0, 10.0, 10.0):
+            self.record(duration)
+        self.record(30.0, kind = "matrix")
+        durations = self.history.durations("s.sln")
+        self.assertEqual(durations[("core", "Debug|Win32")], [10.0] * 4)
+        self.assertEqual(durations[("(matrix)", "Debug|Win32")], [31.0])
+        self.assertEqual(self.history.regressions("s.sln"), [])
+
+    def test_percentiles_report(self):
+        for duration in range(1, 11):
+            self.record(float(duration))
+        lines = self.history.percentiles("s.sln")
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[1].split()[2:], ["5.0", "s", "9.0", "s",
+            "10.0", "s"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+'''Tests for DispatchProxy against a fake IDispatch object.
+
+Run with Python 2 from the repository root:
+    python -m unittest discover -s test
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "plugin"))
+import visual_studio
+from visual_studio import DispatchProxy, DISPID_NEWENUM, \
+        DISP_E_MEMBERNOTFOUND
+
+DISP_E_UNKNOWNNAME = -2147352570
+
+############################################################ {{{1
+class FakeTypeInfo:
+    def __init__(self, iid):
+        self.iid = iid
+
+    def GetTypeAttr(self):
+        return self
+
+class FakeEnum:
+    def __init__(self, items):
+        self.items = list(items)
+
+    def Next(self, count):
+        items, self.items = self.items[:count], self.items[count:]
+        return items
+
+class FakeDispatch:
+    '''IDispatch object with the members in a dict. DISPIDs are given by
+    the interface, a list of member names; the DISPID of a member is its
+    index in the list. Calls to GetIDsOfNames are counted per class.'''
+
+    lookups = 0
+
+    def __init__(self, iid, interface, members, items = None):
+        self.iid = iid
+        self.interface = interface
+        self.members = members
+        self.items = items
+
+    def GetTypeInfo(self):
+        if self.iid is None:
+            raise Exception("No type info")
+        return FakeTypeInfo(self.iid)
+
+    def GetIDsOfNames(self, name):
+        FakeDispatch.lookups += 1
+        if name not in self.interface:
+            raise Exception(DISP_E_UNKNOWNNAME, "Unknown name.", None, None)
+        return self.interface.index(name)
+
+    def Invoke(self, dispid, lcid, flags, retval, *args):
+        if dispid == DISPID_NEWENUM:
+            return FakeEnum(self.items)
+        if not 0 <= dispid < len(self.interface) or \
+                self.interface[dispid] not in self.members:
+            raise Exception(DISP_E_MEMBERNOTFOUND, "Member not found.",
+                    None, None)
+        value = self.members[self.interface[dispid]]
+        if callable(value):
+            return value(*args)
+        return value
+
+def fake_collection(iid, items):
+    return FakeDispatch(iid, ["Count", "Item"],
+            {"Count": len(items), "Item": lambda i: items[i - 1]}, items)
+
+def fake_item(name):
+    return FakeDispatch("{ProjectItem}", ["Name", "Kind"],
+            {"Name": name, "Kind": "file"})
+
+############################################################ {{{1
+class DispatchProxyTest(unittest.TestCase):
+    def setUp(self):
+        DispatchProxy.dispids = {}
+        FakeDispatch.lookups = 0
+
+    def test_dispids_are_looked_up_once_per_interface(self):
+        items = [fake_item("%d.cpp" % i) for i in range(101)]
+        project = DispatchProxy(FakeDispatch("{Project}",
+            ["Name", "ProjectItems"],
+            {"Name": "project",
+                "ProjectItems": fake_collection("{ProjectItems}", items)}))
+
+        names = [(item.Name, item.Kind) for item in project.ProjectItems]
+        self.assertEqual(len(names), 101)
+        self.assertEqual(names[100], ("100.cpp", "file"))
+        self.assertEqual(project.Name, "project")
+        # ProjectItems, Name and Kind, and Name of the project
+        self.assertEqual(FakeDispatch.lookups, 4)
+
+    def test_interfaces_with_different_dispids_do_not_share_a_cache(self):
+        # Two objects reached the same way, but implementing different
+        # interfaces in which the DISPID of Name refers to other members
+        vc_item = DispatchProxy(FakeDispatch("{VCFile}",
+            ["Name", "Kind"], {"Name": "a.cpp", "Kind": "file"}))
+        other_item = DispatchProxy(FakeDispatch("{FolderItem}",
+            ["Kind", "Name"], {"Name": "folder", "Kind": "folder"}))
+        self.assertEqual(vc_item.Name, "a.cpp")
+        self.assertEqual(other_item.Name, "folder")
+        self.assertEqual(vc_item.Kind, "file")
+        self.assertEqual(other_item.Kind, "folder")
+        self.assertEqual(FakeDispatch.lookups, 4)
+
+    def test_member_not_found_is_looked_up_again(self):
+        DispatchProxy(fake_item("a.cpp")).Name
+        # An object that resolves Name to another DISPID than the cached one
+        item = DispatchProxy(FakeDispatch("{ProjectItem}",
+            ["Kind", "Name"], {"Name": "b.cpp"}))
+        self.assertEqual(item.Name, "b.cpp")
+        self.assertEqual(DispatchProxy.dispids["{ProjectItem}"]["Name"], 1)
+        self.assertEqual(FakeDispatch.lookups, 2)
+
+    def test_other_errors_are_raised(self):
+        item = DispatchProxy(fake_item("a.cpp"))
+        self.assertRaises(Exception, getattr, item, "Missing")
+
+    def test_objects_without_type_info_cache_per_object(self):
+        first = DispatchProxy(FakeDispatch(None, ["Name"], {"Name": "a"}))
+        second = DispatchProxy(FakeDispatch(None, ["Kind", "Name"],
+            {"Name": "b"}))
+        self.assertEqual((first.Name, first.Name), ("a", "a"))
+        self.assertEqual(second.Name, "b")
+        self.assertEqual(FakeDispatch.lookups, 2)
+        self.assertEqual(DispatchProxy.dispids, {})
+
+    def test_iteration_uses_newenum(self):
+        items = [fake_item("%d.h" % i) for i in range(130)]
+        collection = DispatchProxy(fake_collection("{ProjectItems}", items))
+        proxies = list(collection)
+        self.assertEqual(len(proxies), 130)
+        self.assertTrue(isinstance(proxies[0], DispatchProxy))
+        self.assertEqual(proxies[129].Name, "129.h")
+        self.assertEqual(collection.Item(2).Name, "1.h")
+
+    def test_results_that_are_not_objects_are_not_wrapped(self):
+        item = DispatchProxy(FakeDispatch("{ProjectItem}",
+            ["FileCount"], {"FileCount": 3}))
+        self.assertEqual(item.FileCount, 3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+'''Tests for DTEWrapper commands against fake DTE objects.
+
+Run with Python 2 from the repository root:
+    python -m unittest discover -s test
+'''
+
+import imp
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "plugin"))
+import visual_studio
+from visual_studio import DTEWrapper, VimExt, to_vim
+
+# PyWin32 is only available on Windows; the tests only need com_error
+try:
+    import pywintypes
+except ImportError:
+    pywintypes = imp.new_module("pywintypes")
+    class com_error(Exception):
+        pass
+    pywintypes.com_error = com_error
+    sys.modules["pywintypes"] = pywintypes
+
+RPC_E_CALL_REJECTED = -2147418111
+
+############################################################ {{{1
+class FakeObject:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class DTEWrapperTest(unittest.TestCase):
+    def setUp(self):
+        self.commands = []
+        self.saved = dict((name, VimExt.__dict__[name])
+                for name in ("command", "activate"))
+        VimExt.command = classmethod(
+                lambda cls, command, raw = False:
+                    self.commands.append(command))
+        VimExt.activate = classmethod(lambda cls: None)
+
+        self.dte = DTEWrapper()
+        self.dte.dtes = {1: FakeObject(Solution = FakeObject(
+            FullName = u"C:\\src\\s.sln"))}
+        self.dte.current_dte = 1
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(VimExt, name, value)
+
+    def test_compile_file_handles_com_error_without_excepinfo(self):
+        def run_build(name, func, *args):
+            raise pywintypes.com_error(RPC_E_CALL_REJECTED,
+                    "Call was rejected by callee.", None, None)
+        self.dte.run_build = run_build
+        self.dte.compile_file("output.txt")
+        self.assertTrue([c for c in self.commands
+            if "Failed to compile file." in c])
+
+############################################################ {{{1
+class ToVimTest(unittest.TestCase):
+    def test_scalars(self):
+        self.assertEqual(to_vim(None), "0")
+        self.assertEqual(to_vim(True), "1")
+        self.assertEqual(to_vim(3), "3")
+        self.assertEqual(to_vim(2.5), "2.5")
+        self.assertEqual(to_vim("it's"), "'it''s'")
+        self.assertEqual(to_vim(u"caf\xe9"), "'caf\xc3\xa9'")
+
+    def test_backslashes_are_not_escaped(self):
+        self.assertEqual(to_vim("c:\\src\\a.cpp"), "'c:\\src\\a.cpp'")
+
+    def test_lists_and_dicts(self):
+        self.assertEqual(to_vim([1, ["a", None]]), "[1, ['a', 0]]")
+        self.assertEqual(to_vim({"n": [u"x"]}), "{'n': ['x']}")
+        self.assertEqual(to_vim([]), "[]")
+
+class FakeVim:
+    def __init__(self):
+        self.commands = []
+
+    def command(self, command):
+        self.commands.append(command)
+
+class VimExtLetTest(unittest.TestCase):
+    def setUp(self):
+        visual_studio.vim = FakeVim()
+
+    def tearDown(self):
+        del visual_studio.vim
+
+    def test_unc_paths_are_kept(self):
+        VimExt.let("s:batch_results", ["\\\\server\\share\\a.cpp"])
+        self.assertEqual(visual_studio.vim.commands,
+                ["let s:batch_results = ['\\\\server\\share\\a.cpp']"])
+
+    def test_command_collapses_repr_backslashes(self):
+        VimExt.command("let s:x = %s" % ["c:\\src"])
+        self.assertEqual(visual_studio.vim.commands, ["let s:x = ['c:\\src']"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+'''Tests for ProjectTree and the project trees built by DTEWrapper.
+
+Run with Python 2 from the repository root:
+    python -m unittest discover -s test
+'''
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "plugin"))
+import visual_studio
+from visual_studio import DTEWrapper, ProjectTree
+
+FILE_KIND = u'{6BB5F8EE-4483-11D3-8BCF-00C04F8EC28C}'
+FOLDER_KIND = u'{6BB5F8EF-4483-11D3-8BCF-00C04F8EC28C}'
+VC_PROJECT_KIND = u'{8BC9CEB8-8B4A-11D0-8D11-00A0C91BC942}'
+
+############################################################ {{{1
+class FakeObject:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class FakeProperties:
+    def __init__(self, path):
+        self.path = path
+
+    def Item(self, name):
+        if self.path is None:
+            raise Exception("Property FullPath not available.")
+        return FakeObject(Value = self.path)
+
+def fake_file(name, path, children = ()):
+    return FakeObject(Name = name, Kind = FILE_KIND,
+            Properties = FakeProperties(path), ProjectItems = list(children))
+
+def fake_folder(name, children = ()):
+    return FakeObject(Name = name, Kind = FOLDER_KIND,
+            ProjectItems = list(children))
+
+def fake_project(name, items):
+    return FakeObject(Name = name, UniqueName = name + ".vcproj",
+            Kind = VC_PROJECT_KIND, Saved = False, ProjectItems = items)
+
+def old_project_tree(wrapper, item):
+    '''The nested list tree as get_project_tree built it before
+    ProjectTree.'''
+    if wrapper.is_file(item):
+        path = wrapper.get_property(item, "FullPath")
+        if path is not None:
+            return [str(item.Name), str(path)]
+    children = []
+    if item.ProjectItems is not None:
+        children += [old_project_tree(wrapper, x) for x in item.ProjectItems]
+    return [str(item.Name), children]
+
+def old_project_files(wrapper, items):
+    '''The file list as get_project_items_files built it before
+    ProjectTree.'''
+    files = []
+    for item in items:
+        if wrapper.is_file(item):
+            path = wrapper.get_property(item, "FullPath")
+            if path is not None:
+                files.append(str(path))
+        files += old_project_files(wrapper, item.ProjectItems)
+    return files
+
+############################################################ {{{1
+class ProjectTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.saved = visual_studio.dispatch
+        visual_studio.dispatch = lambda obj: obj
+        self.wrapper = DTEWrapper()
+
+    def tearDown(self):
+        visual_studio.dispatch = self.saved
+
+    def check(self, project):
+        tree = self.wrapper.get_compact_project_tree(project)
+        self.assertEqual(tree.to_list(),
+                old_project_tree(self.wrapper, project))
+        self.assertEqual(tree.files(),
+                old_project_files(self.wrapper, project.ProjectItems))
+        return tree
+
+    def test_same_shape_as_nested_lists(self):
+        tree = self.check(fake_project("core", [
+            fake_folder("Source Files", [
+                fake_file("a.cpp", "c:\\src\\a.cpp"),
+                fake_folder("detail", [
+                    fake_file("b.cpp", "c:\\src\\detail\\b.cpp")])]),
+            fake_folder("Header Files", [
+                fake_file("a.h", "c:\\src\\a.h")]),
+            fake_file("ReadMe.txt", "c:\\src\\ReadMe.txt")]))
+        self.assertEqual(tree.to_list(), ["core", [
+            ["Source Files", [
+                ["a.cpp", "c:\\src\\a.cpp"],
+                ["detail", [["b.cpp", "c:\\src\\detail\\b.cpp"]]]]],
+            ["Header Files", [["a.h", "c:\\src\\a.h"]]],
+            ["ReadMe.txt", "c:\\src\\ReadMe.txt"]]])
+
+    def test_file_with_child_items(self):
+        # E.g. a form with its code behind file; the children are not in
+        # the tree, but their files are listed
+        tree = self.check(fake_project("ui", [
+            fake_file("Form.cs", "c:\\src\\Form.cs", [
+                fake_file("Form.Designer.cs", "c:\\src\\Form.Designer.cs")])]))
+        self.assertEqual(tree.to_list(),
+                ["ui", [["Form.cs", "c:\\src\\Form.cs"]]])
+        self.assertEqual(tree.files(),
+                ["c:\\src\\Form.cs", "c:\\src\\Form.Designer.cs"])
+
+    def test_file_without_full_path(self):
+        tree = self.check(fake_project("core", [
+            fake_file("missing.cpp", None, [
+                fake_file("a.cpp", "c:\\src\\a.cpp")])]))
+        self.assertEqual(tree.to_list(), ["core", [
+            ["missing.cpp", [["a.cpp", "c:\\src\\a.cpp"]]]]])
+        self.assertEqual(tree.files(), ["c:\\src\\a.cpp"])
+
+    def test_empty_filter(self):
+        tree = self.check(fake_project("core", [
+            fake_folder("Resource Files"),
+            fake_file("a.cpp", "a.cpp")]))
+        self.assertEqual(tree.to_list(), ["core", [
+            ["Resource Files", []], ["a.cpp", "a.cpp"]]])
+
+    def test_empty_project(self):
+        tree = self.check(fake_project("empty", []))
+        self.assertEqual(tree.to_list(), ["empty", []])
+        self.assertEqual(tree.files(), [])
+
+    def test_empty_tree(self):
+        tree = ProjectTree()
+        self.assertEqual(len(tree), 0)
+        self.assertEqual(tree.to_list(), [])
+        self.assertEqual(tree.files(), [])
+
+    def test_files_in_depth_first_order(self):
+        tree = ProjectTree()
+        root = tree.add(-1, "core")
+        first = tree.add(root, "first")
+        tree.add(root, "z.cpp", "c:\\z.cpp")
+        tree.add(first, "b.cpp", "c:\\b.cpp")
+        tree.add(first, "a.cpp", "c:\\a.cpp")
+        tree.freeze()
+        # Children are listed in the order they were added, files depth first
+        self.assertEqual(tree.to_list(), ["core", [
+            ["first", [["b.cpp", "c:\\b.cpp"], ["a.cpp", "c:\\a.cpp"]]],
+            ["z.cpp", "c:\\z.cpp"]]])
+        self.assertEqual(tree.files(),
+                ["c:\\b.cpp", "c:\\a.cpp", "c:\\z.cpp"])
+
+    def test_directories_are_shared(self):
+        tree = ProjectTree()
+        root = tree.add(-1, "core")
+        tree.add(root, "a.cpp", "c:\\src\\a.cpp")
+        tree.add(root, "b.cpp", "c:/src/b.cpp")
+        tree.add(root, "c.cpp", "c:\\src\\c.cpp")
+        self.assertEqual(tree.strings.count("c:\\src\\"), 1)
+        self.assertEqual(tree.files(),
+                ["c:\\src\\a.cpp", "c:/src/b.cpp", "c:\\src\\c.cpp"])
+
+if __name__ == "__main__":
+    unittest.main()
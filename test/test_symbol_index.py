@@ -0,0 +1,160 @@
+'''Tests for SymbolIndex and the symbol commands.
+
+Run with Python 2 from the repository root:
+    python -m unittest discover -s test
+'''
+
+import os
+import re
+import sys
+import tempfile
+import unittest
+
+plugin_dir = os.path.join(os.path.dirname(__file__), "..", "plugin")
+sys.path.insert(0, plugin_dir)
+import visual_studio
+from visual_studio import DTEWrapper, SymbolIndex, VimExt
+
+############################################################ {{{1
+class SymbolIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.index = SymbolIndex(":memory:")
+        self.index.update([
+            ("a.cpp", 1.0, [
+                (u"Foo", u"Foo", "class", 1),
+                (u"GetValue", u"Foo::GetValue", "function", 3)]),
+            ("b.cpp", 2.0, [
+                (u"get_value_count", u"get_value_count", "function", 9),
+                (u"GVx_%", u"GVx_%", "macro", 1)]),
+            ])
+
+    def names(self, query):
+        return [s[0] for s in self.index.lookup(query)]
+
+    def test_prefix_matches_ignore_case_and_come_shortest_first(self):
+        self.assertEqual(self.names("get"), ["GetValue", "get_value_count"])
+        self.assertEqual(self.index.lookup("foo"),
+                [(u"Foo", u"Foo", u"class", u"a.cpp", 1)])
+
+    def test_fuzzy_matches_follow_prefix_matches(self):
+        self.assertEqual(self.names("gv"),
+                ["GVx_%", "GetValue", "get_value_count"])
+
+    def test_like_wildcards_are_matched_literally(self):
+        self.assertEqual(self.names("x_%"), ["GVx_%"])
+        self.assertEqual(self.names("t_v"), ["get_value_count"])
+
+    def test_limit(self):
+        self.assertEqual(len(self.index.lookup("g", 1)), 1)
+
+    def test_update_replaces_symbols_of_a_file(self):
+        self.index.update([("a.cpp", 3.0, [(u"Bar", u"Bar", "class", 2)])])
+        self.assertEqual(self.names("foo"), [])
+        self.assertEqual(self.names("bar"), ["Bar"])
+        self.assertEqual(self.index.stamps(), {"a.cpp": 3.0, "b.cpp": 2.0})
+
+    def test_remove(self):
+        self.index.remove(["b.cpp"])
+        self.assertEqual(self.index.stamps(), {"a.cpp": 1.0})
+        self.assertEqual(self.index.count(), 2)
+
+############################################################ {{{1
+class FakeObject:
+    def __init__(self, **kw):
+        self.__dict__.update(kw)
+
+class SymbolCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.commands = []
+        self.saved = (visual_studio.dte, VimExt.__dict__["command"])
+        VimExt.command = classmethod(
+                lambda cls, command, raw = False:
+                    self.commands.append(command))
+
+        visual_studio.dte = DTEWrapper()
+        visual_studio.dte.dtes = {1: FakeObject(
+            Solution = FakeObject(FullName = u"C:\\src\\s.sln"))}
+        visual_studio.dte.current_dte = 1
+        index = SymbolIndex(":memory:")
+        index.update([("c:\\src\\a.cpp", 1.0,
+            [(u"GetValue", u"Foo::GetValue", "function", 3)])])
+        visual_studio.dte.symbol_indexes["c:\\src\\s.sln"] = index
+
+    def tearDown(self):
+        visual_studio.dte, VimExt.command = self.saved
+
+    def test_vim_functions_exist(self):
+        # Every function the Vim script calls must be reachable through
+        # dte_execute and dte_execute_batch
+        script = open(os.path.join(plugin_dir, "visual_studio.vim")).read()
+        names = set(re.findall(
+            r'(?:DTEExec\(|\[\[|operations, \[)"(\w+)"', script))
+        self.assertTrue("update_symbol_index" in names)
+        self.assertTrue("find_symbols" in names)
+        for name in names:
+            self.assertTrue(hasattr(visual_studio.dte, name), name)
+
+    def test_find_symbols_through_dte_execute(self):
+        visual_studio.dte_execute("find_symbols", "getv")
+        self.assertEqual(self.commands, ["let s:symbols = [['GetValue', "
+            "'Foo::GetValue', 'function', 'c:\\src\\a.cpp', 3]]"])
+
+    def test_find_symbols_with_non_ascii_names(self):
+        visual_studio.dte.get_symbol_index().update([("c:\\src\\b.cpp", 1.0,
+            [(u"Gr\xf6\xdfe", u"Ma\xdf::Gr\xf6\xdfe", "function", 7)])])
+        visual_studio.dte_execute("find_symbols", "gr")
+        self.assertEqual(self.commands, ["let s:symbols = [["
+            "'Gr\xc3\xb6\xc3\x9fe', 'Ma\xc3\x9f::Gr\xc3\xb6\xc3\x9fe', "
+            "'function', 'c:\\src\\b.cpp', 7]]"])
+
+############################################################ {{{1
+class UpdateSymbolFileTest(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(".cpp")
+        os.close(handle)
+        self.calls = []
+
+        self.dte = DTEWrapper()
+        self.dte.dtes = {1: FakeObject(
+            Solution = FakeObject(FullName = u"C:\\src\\s.sln"))}
+        self.dte.current_dte = 1
+        self.dte.execute = self.execute
+        self.index = SymbolIndex(":memory:")
+        self.index.update([(self.path, 1.0,
+            [(u"Old", u"Old", "function", 1)])])
+        self.dte.symbol_indexes["c:\\src\\s.sln"] = self.index
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def execute(self, name, func, paths):
+        self.calls.append(paths)
+        return [(path, [(u"New", u"New", "function", 2)]) for path in paths]
+
+    def names(self):
+        return [s[0] for s in self.index.lookup("n") + self.index.lookup("o")]
+
+    def test_written_file_is_indexed(self):
+        self.dte.update_symbol_file(self.path)
+        self.assertEqual(self.calls, [[self.path]])
+        self.assertEqual(self.names(), ["New"])
+        self.assertEqual(self.index.stamps()[self.path],
+                os.path.getmtime(self.path))
+
+    def test_path_is_matched_ignoring_case(self):
+        self.dte.update_symbol_file(self.path.upper())
+        self.assertEqual(self.calls, [[self.path]])
+
+    def test_unchanged_file_is_not_read(self):
+        self.dte.update_symbol_file(self.path)
+        self.dte.update_symbol_file(self.path)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_files_not_in_the_index_are_ignored(self):
+        self.dte.update_symbol_file(self.path[:-4] + "_other.cpp")
+        self.dte.update_symbol_file(self.path[:-4] + ".txt")
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.names(), ["Old"])
+
+if __name__ == "__main__":
+    unittest.main()